@@ -8,16 +8,28 @@ import sys
 import time
 import base64
 import json
+import io
+import contextlib
 import random
 import socket
+import asyncio
 import threading
 import struct
+import signal
+import functools
+import collections
 from pathlib import Path
 from getpass import getpass
 from secrets import token_bytes
 import hashlib
+import hmac
+import zlib
+import zipfile
+import sqlite3
 import subprocess
 import queue
+import mmap
+import tempfile
 
 # ---------------- optional imports ----------------
 # Pillow for images
@@ -41,10 +53,31 @@ try:
 except Exception:
     PYZBAR_OK = False
 
+# numpy for fast stego engines
+try:
+    import numpy as np
+    NUMPY_OK = True
+except Exception:
+    NUMPY_OK = False
+
+# cryptography for authenticated chat encryption
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.exceptions import InvalidTag
+    CRYPTO_OK = True
+except Exception:
+    CRYPTO_OK = False
+
 # yt-dlp check
-from shutil import which
+from shutil import which, disk_usage
 YT_DLP_CMD = "yt-dlp"
-YTDLP_OK = which(YT_DLP_CMD) is not None
+# the yt_dlp package lets downloads run in-process instead of spawning one CLI per URL
+try:
+    import yt_dlp
+    YTDLP_API_OK = True
+except Exception:
+    YTDLP_API_OK = False
+YTDLP_OK = which(YT_DLP_CMD) is not None or YTDLP_API_OK
 
 # ffmpeg presence
 FFMPEG_OK = which("ffmpeg") is not None
@@ -70,7 +103,8 @@ def qr_menu():
                 continue
             link = input("Enter link or text: ").strip()
             watermark = input("Watermark (optional): ").strip() or "KamixChatGPT"
-            make_qr(link, watermark)
+            out = input("Save as (qr_code.png): ").strip() or "qr_code.png"
+            make_qr(link, watermark, out)
         elif ch == "2":
             if not PYZBAR_OK or not PIL_OK:
                 print("\n[!] pyzbar or Pillow not installed. Install with:")
@@ -88,26 +122,164 @@ def qr_menu():
             print("Invalid choice.")
 
 # QR generation and scanning
-def make_qr(link, watermark="KamixChatGPT"):
+QR_BATCH_FORMATS = {"png": ".png", "svg": ".svg", "raw": ".bin"}  # format -> file extension
+QR_BATCH_CHUNK = 64  # rows per pool job
+
+def qr_code(data):
     qr = qrcode.QRCode(version=1, box_size=10, border=4)
-    qr.add_data(link)
+    qr.add_data(data)
     qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white").convert("RGB")
-    # watermark
-    draw = ImageDraw.Draw(img)
+    return qr
+
+@functools.lru_cache(maxsize=1)
+def qr_font():
     try:
-        font = ImageFont.load_default()
+        return ImageFont.load_default()
     except Exception:
-        font = None
-    bbox = draw.textbbox((0,0), watermark, font=font) if font else (0,0,len(watermark),1)
-    text_w = bbox[2]-bbox[0]
-    text_h = bbox[3]-bbox[1]
-    pos = (img.size[0]-text_w-6, img.size[1]-text_h-6)
-    draw.text(pos, watermark, fill=(255,0,0), font=font)
-    out = "qr_code.png"
+        return None
+
+@functools.lru_cache(maxsize=32)
+def qr_stamp(watermark):
+    """`watermark` drawn once as an RGBA stamp, with the text width and height it is placed by."""
+    bbox = ImageDraw.Draw(Image.new("RGB", (1, 1))).textbbox((0,0), watermark, font=qr_font())
+    stamp = Image.new("RGBA", (max(1, bbox[2]), max(1, bbox[3])), (0,0,0,0))
+    ImageDraw.Draw(stamp).text((0,0), watermark, fill=(255,0,0,255), font=qr_font())
+    return stamp, bbox[2]-bbox[0], bbox[3]-bbox[1]
+
+def render_qr(link, watermark="KamixChatGPT"):
+    """The QR code for `link` as an RGB image, `watermark` in red at the bottom right."""
+    qr = qr_code(link)
+    matrix = qr.get_matrix()  # modules including the border
+    n = len(matrix)
+    # one grey pixel per module, scaled up: much faster than drawing every box
+    img = Image.frombytes("L", (n, n), bytes(0 if v else 255 for row in matrix for v in row))
+    img = img.resize((n * qr.box_size, n * qr.box_size), Image.NEAREST).convert("RGB")
+    if watermark:
+        stamp, text_w, text_h = qr_stamp(watermark)
+        img.paste(stamp, (img.size[0]-text_w-6, img.size[1]-text_h-6), stamp)
+    return img
+
+def qr_svg(link, watermark="KamixChatGPT"):
+    """The QR code for `link` as SVG bytes: one path of module runs and the watermark as text."""
+    from xml.sax.saxutils import escape
+    qr = qr_code(link)
+    matrix = qr.get_matrix()
+    n, box = len(matrix), qr.box_size
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < n:
+            if row[x]:
+                start = x
+                while x < n and row[x]:
+                    x += 1
+                runs.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+            x += 1
+    mark = (f'<text x="{n - 0.6}" y="{n - 0.6}" text-anchor="end" font-family="monospace" font-size="1.1" '
+            f'fill="#f00">{escape(watermark)}</text>') if watermark else ""
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{n * box}" height="{n * box}" viewBox="0 0 {n} {n}">'
+            f'<rect width="{n}" height="{n}" fill="#fff"/><path d="{"".join(runs)}" fill="#000"/>{mark}</svg>\n').encode('utf-8')
+
+def qr_raw(link):
+    """The QR code for `link` as raw modules: >H side length, then each row (no border)
+    one bit per module, dark = 1, most significant bit first, padded to whole bytes."""
+    modules = qr_code(link).modules
+    n = len(modules)
+    pad = "0" * (-n % 8)
+    rows = (int("".join("1" if v else "0" for v in row) + pad, 2).to_bytes((n + 7) // 8, 'big') for row in modules)
+    return struct.pack(">H", n) + b"".join(rows)
+
+def make_qr(link, watermark="KamixChatGPT", out="qr_code.png"):
+    img = render_qr(link, watermark)
     img.save(out)
     print(f"\n✅ QR saved as {out}")
 
+def _qr_batch_job(rows, fmt):
+    """Pool job: render (name, data, watermark) rows to (name, bytes, None) or (name, None, error)."""
+    done = []
+    for name, data, watermark in rows:
+        try:
+            if fmt == "svg":
+                blob = qr_svg(data, watermark)
+            elif fmt == "raw":
+                blob = qr_raw(data)
+            else:
+                with io.BytesIO() as buf:
+                    render_qr(data, watermark).save(buf, "PNG")
+                    blob = buf.getvalue()
+            done.append((name, blob, None))
+        except Exception as e:
+            done.append((name, None, str(e)))
+    return done
+
+def _qr_entry_name(name, ext, taken):
+    """`name` as a relative path with no '..', the format's extension, and unique among `taken`."""
+    parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".", "..")]
+    base = "/".join(parts) or "qr"
+    if base.lower().endswith(ext):
+        base = base[:-len(ext)]
+    entry, n = base + ext, 1
+    while entry in taken:
+        n += 1
+        entry = f"{base}_{n}{ext}"
+    taken.add(entry)
+    return entry
+
+def run_qr_batch(manifest, output, fmt="png", workers=None, watermark="KamixChatGPT"):
+    """Render one QR code per manifest row (data, name[, watermark]; CSV with a header or
+    JSONL) on a process pool. Each worker loads the font and draws every watermark once.
+    An `output` ending in .zip gets all codes as entries of that one archive; anything
+    else is a directory with a file per code."""
+    if not QRGEN_OK or (fmt == "png" and not PIL_OK):
+        print("qrcode (and Pillow for PNG) not installed. Install with: pip install qrcode[pil] pillow"); return
+    if not os.path.exists(manifest):
+        print("Manifest not found."); return
+    rows, failed = [], []
+    for i, row in enumerate(load_manifest(manifest), 1):
+        data = row.get("data") or row.get("link")
+        if not data:
+            failed.append((row.get("name") or f"row {i}", "no data")); continue
+        # a blank watermark cell means the default; --watermark '' turns it off for all
+        rows.append((row.get("name") or f"qr_{i:06d}", data, row.get("watermark") or watermark))
+    workers = workers or os.cpu_count() or 1
+    chunks = [(rows[i:i + QR_BATCH_CHUNK], fmt) for i in range(0, len(rows), QR_BATCH_CHUNK)]
+    print(f"{len(rows)} QR codes as {fmt} on {workers} worker(s) -> {output}")
+    ext, taken, ok = QR_BATCH_FORMATS[fmt], set(), 0
+    t0 = time.perf_counter()
+    archive = output.lower().endswith(".zip")
+    if archive:
+        part = output + ".part"
+        # PNG is compressed already; SVG and raw rows shrink well
+        out = zipfile.ZipFile(part, "w", zipfile.ZIP_STORED if fmt == "png" else zipfile.ZIP_DEFLATED)
+    else:
+        os.makedirs(output, exist_ok=True)
+    try:
+        for done in run_spans(_qr_batch_job, chunks, workers):
+            for name, blob, error in done:
+                if blob is None:
+                    failed.append((name, error)); continue
+                entry = _qr_entry_name(name, ext, taken)
+                if archive:
+                    out.writestr(entry, blob)
+                else:
+                    path = os.path.join(output, *entry.split("/"))
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, "wb") as f:
+                        f.write(blob)
+                ok += 1
+    except BaseException:
+        if archive:
+            out.close()
+            os.remove(part)
+        raise
+    if archive:
+        out.close()
+        os.replace(part, output)
+    secs = time.perf_counter() - t0
+    for name, error in failed[:10]:
+        print(f"[failed] {name}: {error}")
+    print(f"Done in {secs:.1f}s: {ok} ok ({ok / secs if secs else 0:.0f}/s), {len(failed)} failed. Output: {output}")
+
 def scan_qr_image(path):
     if not os.path.exists(path):
         print("File not found.")
@@ -185,8 +357,9 @@ def video_menu():
         print("1) Download single URL")
         print("2) Batch download from file")
         print("3) Install instructions / Check yt-dlp")
-        print("4) Back")
-        ch = input("Choose (1-4): ").strip()
+        print("4) Verify download archive")
+        print("5) Back")
+        ch = input("Choose (1-5): ").strip()
         if ch == "1":
             if not YTDLP_OK:
                 print("\n[!] yt-dlp not found. Install via:")
@@ -207,6 +380,16 @@ def video_menu():
             print("pip install yt-dlp")
             press_enter()
         elif ch == "4":
+            outdir = input("Download dir (default downloads): ").strip() or "downloads"
+            archive_path = Path(outdir) / DOWNLOAD_ARCHIVE_NAME
+            if not archive_path.exists():
+                print("No archive in that folder.")
+            else:
+                archive = DownloadArchive(archive_path)
+                archive.verify()
+                archive.close()
+            press_enter()
+        elif ch == "5":
             break
         else:
             print("Invalid choice.")
@@ -235,15 +418,240 @@ def build_yt_dlp_cmd(url, outdir, template, fmt, extra_args=None):
         cmd = [YT_DLP_CMD] + extra_args + ["-o", output, "-f", fmt, url]
     return cmd
 
-def run_cmd(cmd):
+# CLI progress lines fed to TransferMeter: downloaded bytes, speed (B/s), file
+PROGRESS_TEMPLATE = "download:KAMIPROG %(progress.downloaded_bytes)s %(progress.speed)s %(progress.filename)s"
+DOWNLOAD_METRICS_NAME = "download_metrics.jsonl"
+
+def transfer_args(fragments=1):
+    """yt-dlp args that keep and resume .part files and fetch `fragments` fragments at once."""
+    return ["--continue", "--part", "--concurrent-fragments", str(max(1, fragments))]
+
+class TransferMeter:
+    """Bytes moved and peak speed for one URL across attempts, from yt-dlp progress
+    reports (API hooks or PROGRESS_TEMPLATE lines). A retry that resumes a .part file
+    only counts what it fetched after the resume point."""
+    def __init__(self):
+        self.attempt = 0
+        self.peak = 0.0
+        self._spans = {}  # (attempt, filename) -> [first, last] downloaded_bytes
+    def new_attempt(self):
+        self.attempt += 1
+    def observe(self, filename, downloaded, speed=None):
+        if downloaded is None:
+            return
+        span = self._spans.get((self.attempt, filename))
+        if span is None:
+            resumed = any(name == filename for _, name in self._spans)
+            self._spans[(self.attempt, filename)] = [downloaded if resumed else 0, downloaded]
+        else:
+            span[1] = max(span[1], downloaded)
+        if speed:
+            self.peak = max(self.peak, float(speed))
+    def observe_line(self, line):
+        """Feed one line of CLI output; True if it was a PROGRESS_TEMPLATE line."""
+        if not line.startswith("KAMIPROG "):
+            return False
+        parts = line.rstrip("\n").split(" ", 3)
+        if len(parts) == 4:
+            num = lambda v: float(v) if v.replace(".", "", 1).isdigit() else None
+            self.observe(parts[3], num(parts[1]), num(parts[2]))
+        return True
+    @property
+    def bytes(self):
+        return int(sum(last - first for first, last in self._spans.values()))
+
+def run_metered_cmd(cmd, meter, log=None):
+    """Run a yt-dlp CLI command feeding its progress to `meter`; other output goes to
+    `log` (or the console, with a one-line progress display). Returns the exit code."""
+    cmd = cmd[:1] + ["--newline", "--progress-template", PROGRESS_TEMPLATE] + cmd[1:]
+    out = log or sys.stdout
     try:
-        print("\nRunning:", " ".join(cmd))
-        subprocess.run(cmd, check=True)
-        print("✅ Done.")
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                text=True, encoding="utf-8", errors="replace")
     except FileNotFoundError:
-        print("yt-dlp not found.")
-    except subprocess.CalledProcessError:
-        print("Download failed or cancelled.")
+        out.write("yt-dlp not found.\n")
+        return 127
+    for line in proc.stdout:
+        if not meter.observe_line(line):
+            out.write(line)
+        elif log is None:
+            print(f"\r  {meter.bytes / 1048576:.1f}MiB, peak {meter.peak / 1048576:.2f}MiB/s   ", end="", flush=True)
+    return proc.wait()
+
+def job_metrics(r):
+    """Exportable metrics record for one download result row."""
+    avg = r["meter"].bytes / r["seconds"] if r["seconds"] else 0.0
+    return {"url": r["url"], "host": r["host"], "status": r["status"], "bytes": r["meter"].bytes,
+            "wall_seconds": round(r["seconds"], 3), "avg_bps": round(avg), "peak_bps": round(r["meter"].peak),
+            "retries": max(0, r["attempts"] - 1), "log": r["log"], "finished_at": time.time()}
+
+def export_download_metrics(results, outdir):
+    """Append one JSON metrics record per job to <outdir>/download_metrics.jsonl."""
+    path = Path(outdir) / DOWNLOAD_METRICS_NAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for r in results:
+            f.write(json.dumps(job_metrics(r)) + "\n")
+    return path
+
+def print_job_metrics(r):
+    m = job_metrics(r)
+    print(f"{m['bytes'] / 1048576:.1f}MiB in {m['wall_seconds']:.1f}s, avg {m['avg_bps'] / 1048576:.2f}MiB/s, "
+          f"peak {m['peak_bps'] / 1048576:.2f}MiB/s, {m['retries']} retries")
+
+DOWNLOAD_ARCHIVE_NAME = ".kami_archive.sqlite"
+# appended by the CLI after each final file move: extractor, id, format, path
+ARCHIVE_PRINT = "after_move:%(extractor_key)s\t%(id)s\t%(format_id)s\t%(filepath)s"
+
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _archive_cmd(cmd, print_path):
+    """CLI command that also appends ARCHIVE_PRINT lines for finished files to print_path."""
+    return cmd[:1] + ["--print-to-file", ARCHIVE_PRINT, str(print_path)] + cmd[1:]
+
+def _read_archive_print(print_path):
+    files = []
+    if os.path.exists(print_path):
+        with open(print_path, "r", encoding="utf-8") as f:
+            files = [tuple(line.rstrip("\n").split("\t", 3)) for line in f if line.count("\t") >= 3]
+        os.remove(print_path)
+    return files
+
+def _info_files(info):
+    """(extractor, id, format, path) for every file a yt-dlp info dict (or playlist) produced."""
+    if info.get("_type") == "playlist":
+        return [f for entry in info.get("entries") or [] if entry for f in _info_files(entry)]
+    path = info.get("filepath") or next((d.get("filepath") for d in info.get("requested_downloads") or []), None)
+    return [(info.get("extractor_key"), info.get("id"), info.get("format_id"), path)] if path else []
+
+class DownloadArchive:
+    """SQLite index of finished downloads keyed by (extractor, video id), with format,
+    size, path and SHA-256 per file. Lookups match the URL offline via yt-dlp's extractor
+    patterns, falling back to the URL itself."""
+    def __init__(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path))
+        self.db.execute("""CREATE TABLE IF NOT EXISTS downloads (
+            extractor TEXT NOT NULL, video_id TEXT NOT NULL, url TEXT, format TEXT,
+            size INTEGER, path TEXT, sha256 TEXT, fetched REAL, PRIMARY KEY (extractor, video_id))""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS downloads_url ON downloads (url)")
+        self.db.commit()
+        self._extractors = None
+    def key_for(self, url):
+        """(extractor, id) from the URL alone, without network access; None if not recognised."""
+        if not YTDLP_API_OK:
+            return None
+        if self._extractors is None:
+            self._extractors = [ie for ie in yt_dlp.extractor.gen_extractor_classes() if ie.ie_key() != "Generic"]
+        for ie in self._extractors:
+            if ie.suitable(url):
+                vid = ie.get_temp_id(url)
+                return (ie.ie_key(), vid) if vid else None
+        return None
+    def lookup(self, url):
+        """Archived paths for this URL if every one still exists on disk, else []."""
+        key = self.key_for(url)
+        rows = self.db.execute("SELECT path FROM downloads WHERE extractor=? AND video_id=?", key).fetchall() if key else []
+        if not rows:
+            rows = self.db.execute("SELECT path FROM downloads WHERE url=?", (url,)).fetchall()
+        return [r[0] for r in rows] if rows and all(os.path.exists(r[0]) for r in rows) else []
+    def add(self, url, files):
+        for extractor, vid, fmt, path in files:
+            if not path or not os.path.exists(path):
+                continue
+            self.db.execute("INSERT OR REPLACE INTO downloads VALUES (?,?,?,?,?,?,?,?)",
+                            (extractor or "", vid or url, url, fmt, os.path.getsize(path), str(path),
+                             _sha256_file(path), time.time()))
+        self.db.commit()
+    def verify(self):
+        """Re-hash every archived file and drop entries whose file is missing or changed."""
+        good = bad = 0
+        rows = self.db.execute("SELECT extractor, video_id, path, size, sha256 FROM downloads").fetchall()
+        for extractor, vid, path, size, digest in rows:
+            if not os.path.exists(path):
+                reason = "missing"
+            elif os.path.getsize(path) != size or _sha256_file(path) != digest:
+                reason = "corrupted"
+            else:
+                good += 1
+                continue
+            bad += 1
+            print(f"[{reason}] {extractor} {vid}: {path}")
+            self.db.execute("DELETE FROM downloads WHERE extractor=? AND video_id=?", (extractor, vid))
+        self.db.commit()
+        print(f"{good} ok, {bad} removed from archive")
+        return good, bad
+    def close(self):
+        self.db.close()
+
+class _YdlLog:
+    """yt-dlp logger that writes to a swappable stream (stdout by default)."""
+    def __init__(self, stream=None):
+        self.stream = stream
+    def _write(self, msg):
+        stream = self.stream or sys.stdout
+        stream.write(msg + "\n")
+        stream.flush()
+    debug = info = warning = error = _write
+
+class YtDlpEngine:
+    """One long-lived yt_dlp.YoutubeDL reused across URLs, configured from the same
+    -o/-f/extra args that build_yt_dlp_cmd() passes to the CLI. Not thread-safe: use
+    one engine per thread."""
+    def __init__(self, outdir, template, fmt, extra_args=None, log_stream=None):
+        outdir = Path(outdir)
+        outdir.mkdir(parents=True, exist_ok=True)
+        argv = list(extra_args or []) + ["-o", str(outdir / template), "-f", fmt]
+        opts = yt_dlp.parse_options(argv).ydl_opts
+        self.log = _YdlLog(log_stream)
+        opts.update({"logger": self.log, "noprogress": True, "progress_hooks": [self._progress]})
+        self.ydl = yt_dlp.YoutubeDL(opts)
+        self.last_status = None
+        self.last_files = []
+        self.meter = None
+    def _progress(self, d):
+        self.last_status = d
+        if self.meter and d.get("status") in ("downloading", "finished"):
+            self.meter.observe(d.get("filename"), d.get("downloaded_bytes") or d.get("total_bytes"), d.get("speed"))
+        if d.get("status") == "finished":
+            self.log._write(f"{'' if self.log.stream else chr(10)}  done: {d.get('filename')}")
+        elif d.get("status") == "downloading" and self.log.stream is None:
+            total = d.get("total_bytes") or d.get("total_bytes_estimate")
+            got = d.get("downloaded_bytes") or 0
+            pct = f"{got * 100 / total:5.1f}%" if total else f"{got / 1048576:.1f}MiB"
+            speed = d.get("speed")
+            rate = f" at {speed / 1048576:.2f}MiB/s" if speed else ""
+            eta = f" ETA {d['eta']}s" if d.get("eta") is not None else ""
+            print(f"\r  {pct}{rate}{eta}   ", end="", flush=True)
+    def download(self, url):
+        """Download one URL; returns 0 on success like the CLI exit code. Files land in last_files."""
+        self.last_files = []
+        try:
+            info = self.ydl.extract_info(url, download=True)
+        except yt_dlp.utils.DownloadError:
+            return 1
+        except Exception as e:
+            self.log._write(f"ERROR: {e}")
+            return 1
+        if not info:
+            return 1
+        self.last_files = _info_files(info)
+        return 0
+    def close(self):
+        self.ydl.close()
+
+def ask_transfer_options():
+    """Prompt for concurrent fragments and retries; returns (fragments, retries) or None."""
+    fragments = input("Concurrent fragments per download (default 1): ").strip() or "1"
+    retries = input("Retries per URL, resuming partial files (default 2): ").strip() or "2"
+    if not fragments.isdigit() or not retries.isdigit() or int(fragments) < 1:
+        print("Invalid number."); return None
+    return int(fragments), int(retries)
 
 def download_single():
     url = input("Paste video URL: ").strip()
@@ -253,9 +661,17 @@ def download_single():
     outdir = input("Output dir (default downloads): ").strip() or "downloads"
     template = input("Filename template (default %(uploader)s - %(title)s [%(id)s].%(ext)s): ").strip() or "%(uploader)s - %(title)s [%(id)s].%(ext)s"
     extra = input("Extra yt-dlp args? (leave blank): ").strip()
-    extra_args = extra.split() if extra else None
-    cmd = build_yt_dlp_cmd(url, outdir, template, fmt, extra_args)
-    run_cmd(cmd)
+    opts = ask_transfer_options()
+    if not opts:
+        return
+    fragments, retries = opts
+    extra_args = transfer_args(fragments) + (extra.split() if extra else [])
+    engine = YtDlpEngine(outdir, template, fmt, extra_args) if YTDLP_API_OK else None
+    r = download_with_retries(url, outdir, template, fmt, extra_args, engine, retries)
+    if engine:
+        engine.close()
+    print_job_metrics(r)
+    print("Metrics appended to", export_download_metrics([r], outdir))
 
 def download_batch():
     path = input("Path to file with URLs (one per line): ").strip()
@@ -265,15 +681,251 @@ def download_batch():
     outdir = input("Output dir (default downloads): ").strip() or "downloads"
     template = input("Filename template (default %(playlist_title)s/%(playlist_index)s - %(title)s.%(ext)s): ").strip() or "%(playlist_title)s/%(playlist_index)s - %(title)s.%(ext)s"
     extra = input("Extra yt-dlp args? (leave blank): ").strip()
-    extra_args = extra.split() if extra else None
     with open(path, "r", encoding="utf-8") as f:
         urls = [line.strip() for line in f if line.strip() and not line.startswith("#")]
     if not urls:
         print("No URLs found."); return
+    # skip anything the archive already has, before any network call
+    archive = DownloadArchive(Path(outdir) / DOWNLOAD_ARCHIVE_NAME)
+    todo = [url for url in urls if not archive.lookup(url)]
+    if len(todo) < len(urls):
+        print(f"{len(urls) - len(todo)} URL(s) already downloaded (archive), skipping.")
+    urls = todo
+    if not urls:
+        archive.close(); return
+    jobs = input("Parallel downloads (default 1): ").strip() or "1"
+    if not jobs.isdigit() or int(jobs) < 1:
+        print("Invalid number."); archive.close(); return
+    per_host = "1"
+    if int(jobs) > 1:
+        per_host = input("Max downloads per host (default 2): ").strip() or "2"
+        if not per_host.isdigit() or int(per_host) < 1:
+            print("Invalid number."); archive.close(); return
+    opts = ask_transfer_options()
+    if not opts:
+        archive.close(); return
+    fragments, retries = opts
+    extra_args = transfer_args(fragments) + (extra.split() if extra else [])
+    if int(jobs) > 1:
+        download_concurrent(urls, outdir, template, fmt, extra_args, int(jobs), int(per_host), retries,
+                            archive=archive)
+        archive.close()
+        return
+    engine = YtDlpEngine(outdir, template, fmt, extra_args) if YTDLP_API_OK else None
+    results = []
     for i, url in enumerate(urls, 1):
         print(f"\n--- [{i}/{len(urls)}] {url}")
-        cmd = build_yt_dlp_cmd(url, outdir, template, fmt, extra_args)
-        run_cmd(cmd)
+        r = download_with_retries(url, outdir, template, fmt, extra_args, engine, retries)
+        if r["status"] == "ok":
+            archive.add(url, r.pop("files"))
+        results.append(r)
+    if engine:
+        engine.close()
+    archive.close()
+    print_download_summary(results)
+    print("Metrics appended to", export_download_metrics(results, outdir))
+
+def download_with_retries(url, outdir, template, fmt, extra_args=None, engine=None, retries=2, backoff=2.0):
+    """Download one URL on the console, retrying failures after backoff * 2**(attempt-1)
+    seconds. yt-dlp keeps the .part file, so each retry resumes instead of restarting.
+    Returns a result dict like download_concurrent() rows, plus the finished "files"."""
+    r = {"url": url, "host": _url_host(url), "status": "pending", "attempts": 0, "seconds": 0.0,
+         "log": None, "meter": TransferMeter(), "files": []}
+    while True:
+        r["attempts"] += 1
+        r["meter"].new_attempt()
+        started = time.monotonic()
+        if engine:
+            print("\nDownloading:", url)
+            engine.meter = r["meter"]
+            code = engine.download(url)
+            engine.meter = None
+            files = engine.last_files
+        else:
+            fd, print_path = tempfile.mkstemp(suffix=".files")
+            os.close(fd)
+            cmd = _archive_cmd(build_yt_dlp_cmd(url, outdir, template, fmt, extra_args), print_path)
+            print("\nRunning:", " ".join(cmd))
+            code = run_metered_cmd(cmd, r["meter"])
+            files = _read_archive_print(print_path)
+        r["seconds"] += time.monotonic() - started
+        if code == 0:
+            r["status"], r["files"] = "ok", files
+            print("\n✅ Done.")
+            return r
+        if r["attempts"] > retries:
+            r["status"] = "failed"
+            print("\nDownload failed or cancelled.")
+            return r
+        delay = backoff * 2 ** (r["attempts"] - 1)
+        print(f"\n⚠️  Download failed, resuming in {delay:g}s (retry {r['attempts']}/{retries})")
+        time.sleep(delay)
+
+def _url_host(url):
+    from urllib.parse import urlparse
+    host = (urlparse(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+def run_download_attempt(cmd, log_path, meter):
+    """One yt-dlp attempt with stdout/stderr appended to its own log file.
+
+    Returns (exit code, finished files) like run_download_attempt_api().
+    """
+    print_path = log_path + ".files"
+    cmd = _archive_cmd(cmd, print_path)
+    with open(log_path, "a", encoding="utf-8") as log:
+        log.write(f"$ {' '.join(cmd)}\n")
+        log.flush()
+        code = run_metered_cmd(cmd, meter, log)
+    return code, _read_archive_print(print_path)
+
+def run_download_attempt_api(local, engines, url, log_path, meter, outdir, template, fmt, extra_args):
+    """In-process attempt on this thread's YtDlpEngine, logging to the URL's own file."""
+    engine = getattr(local, "engine", None)
+    if engine is None:
+        engine = local.engine = YtDlpEngine(outdir, template, fmt, extra_args)
+        engines.append(engine)
+    with open(log_path, "a", encoding="utf-8") as log:
+        log.write(f"$ yt_dlp {url}\n")
+        engine.log.stream, engine.meter = log, meter
+        try:
+            return engine.download(url), engine.last_files
+        finally:
+            engine.log.stream, engine.meter = None, None
+
+def download_concurrent(urls, outdir, template, fmt, extra_args=None, jobs=4, per_host=2, retries=2, backoff=2.0,
+                        archive=None):
+    """Keep up to `jobs` downloads running (at most `per_host` per host), retrying
+    failures (an attempt that raises counts as one) after backoff * 2**(attempt-1)
+    seconds; retries resume .part files. Each URL
+    logs to <outdir>/_logs/NNNN.log and its metrics go to download_metrics.jsonl.
+    Uses one in-process YtDlpEngine per pool thread when yt_dlp is importable. Finished
+    files are recorded in `archive` from this thread only, so SQLite is never shared."""
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    log_dir = Path(outdir) / "_logs"
+    log_dir.mkdir(parents=True, exist_ok=True)
+    results = [{"url": url, "host": _url_host(url), "status": "pending", "attempts": 0, "seconds": 0.0,
+                "log": str(log_dir / f"{i:04d}.log"), "meter": TransferMeter()} for i, url in enumerate(urls, 1)]
+    pending = [(0.0, i) for i in range(len(urls))]  # (not before, index)
+    active = {}
+    host_active = {}
+    local = threading.local()
+    engines = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or active:
+            now = time.monotonic()
+            for item in list(pending):
+                if len(active) >= jobs:
+                    break
+                not_before, i = item
+                r = results[i]
+                if not_before > now or host_active.get(r["host"], 0) >= per_host:
+                    continue
+                pending.remove(item)
+                host_active[r["host"]] = host_active.get(r["host"], 0) + 1
+                r["attempts"] += 1
+                r["meter"].new_attempt()
+                if YTDLP_API_OK:
+                    fut = pool.submit(run_download_attempt_api, local, engines, r["url"], r["log"], r["meter"],
+                                      outdir, template, fmt, extra_args)
+                else:
+                    fut = pool.submit(run_download_attempt, build_yt_dlp_cmd(r["url"], outdir, template, fmt, extra_args),
+                                      r["log"], r["meter"])
+                active[fut] = (i, now)
+            waiting = [nb - now for nb, _ in pending if nb > now]
+            timeout = max(0.05, min(waiting)) if waiting else None
+            if not active:
+                time.sleep(timeout or 0.05)
+                continue
+            done, _ = wait(active, timeout=timeout, return_when=FIRST_COMPLETED)
+            for fut in done:
+                i, started = active.pop(fut)
+                r = results[i]
+                host_active[r["host"]] -= 1
+                r["seconds"] += time.monotonic() - started
+                tag = f"[{i + 1}/{len(urls)}]"
+                try:
+                    code, files = fut.result()
+                except Exception as e:
+                    # e.g. the yt-dlp binary vanished or the log disk filled: a failed attempt
+                    code, files = None, []
+                    try:
+                        with open(r["log"], "a", encoding="utf-8") as log:
+                            log.write(f"! attempt {r['attempts']} raised {type(e).__name__}: {e}\n")
+                    except OSError:
+                        pass
+                if code == 0:
+                    r["status"] = "ok"
+                    if archive:
+                        archive.add(r["url"], files)
+                    print(f"✅ {tag} {r['url']}")
+                elif r["attempts"] <= retries:
+                    delay = backoff * 2 ** (r["attempts"] - 1)
+                    pending.append((time.monotonic() + delay, i))
+                    print(f"⚠️  {tag} failed, retry {r['attempts']}/{retries} in {delay:g}s: {r['url']}")
+                else:
+                    r["status"] = "failed"
+                    print(f"❌ {tag} failed after {r['attempts']} attempt(s), see {r['log']}")
+    for engine in engines:
+        engine.close()
+    print_download_summary(results)
+    print("Metrics appended to", export_download_metrics(results, outdir))
+    return results
+
+def print_download_summary(results):
+    print("\n  #  Status  Tries  Time(s)      MiB  Avg MiB/s  Peak MiB/s  URL")
+    for i, r in enumerate(results, 1):
+        m = job_metrics(r)
+        print(f"{i:>3}  {r['status']:<6}  {r['attempts']:>5}  {r['seconds']:>7.1f}  {m['bytes'] / 1048576:>7.1f}"
+              f"  {m['avg_bps'] / 1048576:>9.2f}  {m['peak_bps'] / 1048576:>10.2f}  {r['url']}")
+    ok = sum(1 for r in results if r["status"] == "ok")
+    total = sum(r["seconds"] for r in results)
+    moved = sum(r["meter"].bytes for r in results)
+    print(f"\n{ok} ok, {len(results) - ok} failed, {moved / 1048576:.1f}MiB in {total:.1f}s of download time")
+
+# ---------------- Parallel stego helpers ----------------
+# payload bytes per pool job; a multiple of 12 keeps spans aligned for 3 channels and 1-4 LSBs
+PARALLEL_SPAN_BYTES = 3 << 20
+
+def make_pool(workers):
+    """ProcessPoolExecutor for workers > 1; None when serial or the platform cannot start one (e.g. no sem_open)."""
+    if not workers or workers <= 1:
+        return None
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+        return ProcessPoolExecutor(max_workers=workers)
+    except (ImportError, OSError, NotImplementedError):
+        return None
+
+def run_spans(fn, jobs, workers=1):
+    """Yield fn(*job) for each job in order, on a process pool when workers > 1 (else in-process)."""
+    pool = make_pool(workers) if len(jobs) > 1 else None
+    if pool is None:
+        for job in jobs:
+            yield fn(*job)
+        return
+    with pool:
+        yield from pool.map(fn, *zip(*jobs))
+
+def span_jobs(start, end, align=1, span=PARALLEL_SPAN_BYTES):
+    """Split [start, end) into (aligned_start, length, skip) spans; only the first may need a skip."""
+    first = start - start % align
+    jobs = []
+    pos = first
+    while pos < end:
+        stop = min(end, (pos // span + 1) * span)
+        jobs.append((pos, stop - pos, start - pos if pos == first else 0))
+        pos = stop
+    return jobs
+
+def _payload_slice(header, secret_path, start, length):
+    """Bytes [start, start+length) of header + secret file, read without loading the whole file."""
+    out = header[start:start+length]
+    if len(out) < length:
+        with open(secret_path, "rb") as f:
+            f.seek(max(0, start - len(header)))
+            out += f.read(length - len(out))
+    return out
 
 # ---------------- Audio stego (WAV LSB) ----------------
 def audio_stego_menu():
@@ -287,17 +939,29 @@ def audio_stego_menu():
             cover = input("Cover audio path (wav or other): ").strip()
             secret = input("Secret file path: ").strip()
             out = input("Output stego wav (default stego_output.wav): ").strip() or "stego_output.wav"
-            embed_audio_wrapper(cover, secret, out)
+            lsbs = input("LSBs per sample (1-4, default 1): ").strip() or "1"
+            if not lsbs.isdigit() or not 1 <= int(lsbs) <= 4:
+                print("Invalid LSB count."); continue
+            workers = input("Worker processes (default 1): ").strip() or "1"
+            if not workers.isdigit() or int(workers) < 1:
+                print("Invalid worker count."); continue
+            embed_audio_wrapper(cover, secret, out, int(lsbs), workers=int(workers))
         elif ch == "2":
             stego = input("Stego WAV path: ").strip()
             outdir = input("Output folder (default .): ").strip() or "."
-            extract_audio(stego, outdir)
+            workers = input("Worker processes (default 1): ").strip() or "1"
+            if not workers.isdigit() or int(workers) < 1:
+                print("Invalid worker count."); continue
+            extract_audio(stego, outdir, workers=int(workers))
         elif ch == "3":
             break
         else:
             print("Invalid choice.")
 
 MAGIC = b"KAMIAUD1"
+# v2: MAGIC_V2 + mode byte (sampwidth << 4 | lsbs) at 1 LSB, then the header at `lsbs` bits/sample
+MAGIC_V2 = b"KAMIAUD2"
+AUDIO_PREFIX_BITS = (len(MAGIC_V2) + 1) * 8
 def has_ffmpeg():
     return FFMPEG_OK
 
@@ -309,6 +973,69 @@ def convert_to_wav(src, tmp):
     except Exception:
         return False
 
+class FFmpegPCMReader:
+    """wave.Wave_read look-alike over raw s16le PCM streamed from ffmpeg's stdout."""
+    def __init__(self, src, framerate=44100, nchannels=2):
+        cmd = ["ffmpeg", "-nostdin", "-v", "error", "-i", src, "-ar", str(framerate), "-ac", str(nchannels),
+               "-f", "s16le", "-acodec", "pcm_s16le", "pipe:1"]
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.nchannels = nchannels
+        self.framerate = framerate
+    def getparams(self):
+        from types import SimpleNamespace
+        return SimpleNamespace(nchannels=self.nchannels, sampwidth=2, framerate=self.framerate, nframes=None)
+    def readframes(self, n):
+        data = self.proc.stdout.read(n * self.nchannels * 2)
+        if not data and self.proc.wait() != 0:
+            raise subprocess.CalledProcessError(self.proc.returncode, "ffmpeg")
+        return data
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.stdout.close()
+        self.proc.wait()
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        self.close()
+
+def wav_data_offset(path):
+    """Byte offset and size of the PCM `data` chunk in a RIFF/WAVE file."""
+    with open(path, "rb") as f:
+        riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise ValueError("not a RIFF/WAVE file")
+        while True:
+            head = f.read(8)
+            if len(head) < 8:
+                raise ValueError("no data chunk")
+            chunk_id, size = struct.unpack("<4sI", head)
+            if chunk_id == b"data":
+                return f.tell(), size
+            f.seek(size + (size & 1), 1)
+
+def _audio_embed_span(cover_path, cover_offset, out_path, out_offset, sampwidth, lsbs, sample0, a, b,
+                      header, secret_path, payload_total):
+    """Pool job: copy payload samples [a, b) from the cover to the output WAV, with
+    their share of header + secret embedded."""
+    with open(cover_path, "rb") as f:
+        f.seek(cover_offset + (sample0 + a) * sampwidth)
+        raw = f.read((b - a) * sampwidth)
+    start = a * lsbs // 8
+    length = min(b * lsbs // 8, payload_total) - start
+    if length > 0:
+        raw = lsb_embed_samples(raw, _payload_slice(header, secret_path, start, length), sampwidth, lsbs)
+    with open(out_path, "r+b") as f:
+        f.seek(out_offset + (sample0 + a) * sampwidth)
+        f.write(raw)
+
+def _audio_extract_span(wav_path, data_offset, sampwidth, lsbs, sample0, start, length):
+    """Pool job: read one payload span through a read-only mmap of the stego WAV."""
+    a = data_offset + (sample0 + start * 8 // lsbs) * sampwidth
+    b = a + -(-length * 8 // lsbs) * sampwidth
+    with open(wav_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return lsb_extract_samples(mm[a:b], sampwidth, lsbs)[:length]
+
 def bytes_to_bits(b):
     for byte in b:
         for i in range(7, -1, -1):
@@ -327,95 +1054,283 @@ def bits_to_bytes(bits):
             cnt = 0
     return bytes(out)
 
-def embed(cover_wav_path, secret_path, out_wav_path):
+def lsb_embed_samples(raw_frames, payload, sampwidth=2, lsbs=1, use_numpy=NUMPY_OK):
+    """Write payload bits (MSB first) into the low `lsbs` bits of each LE PCM sample."""
+    mask = (1 << lsbs) - 1
+    if use_numpy:
+        buf = np.frombuffer(raw_frames, dtype=np.uint8).copy()
+        low = buf[::sampwidth]
+        bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8))
+        if len(bits) % lsbs:
+            bits = np.concatenate([bits, np.zeros(lsbs - len(bits) % lsbs, dtype=np.uint8)])
+        vals = bits.reshape(-1, lsbs)
+        vals = (vals << np.arange(lsbs - 1, -1, -1, dtype=np.uint8)).sum(axis=1, dtype=np.uint8)
+        n = len(vals)
+        low[:n] = (low[:n] & (0xFF ^ mask)) | vals
+        return buf.tobytes()
+    buf = bytearray(raw_frames)
+    pos = 0
+    cur = 0
+    cnt = 0
+    for bit in bytes_to_bits(payload):
+        cur = (cur << 1) | bit
+        cnt += 1
+        if cnt == lsbs:
+            buf[pos] = (buf[pos] & (0xFF ^ mask)) | cur
+            pos += sampwidth
+            cur = 0
+            cnt = 0
+    if cnt:
+        buf[pos] = (buf[pos] & (0xFF ^ mask)) | (cur << (lsbs - cnt))
+    return bytes(buf)
+
+def lsb_extract_samples(raw_frames, sampwidth=2, lsbs=1, use_numpy=NUMPY_OK):
+    """Collect the low `lsbs` bits of each LE PCM sample back into bytes (partial byte dropped)."""
+    mask = (1 << lsbs) - 1
+    if use_numpy:
+        low = np.frombuffer(raw_frames, dtype=np.uint8)[::sampwidth] & mask
+        bits = np.unpackbits(low[:, None], axis=1)[:, 8 - lsbs:].ravel()
+        bits = bits[:len(bits) - len(bits) % 8]
+        return np.packbits(bits).tobytes()
+    low = memoryview(raw_frames)[::sampwidth]
+    return bits_to_bytes((v >> i) & 1 for v in low for i in range(lsbs - 1, -1, -1))
+
+# frames per read/write block; a multiple of 8 keeps every block byte-aligned
+AUDIO_CHUNK_FRAMES = 64 * 1024
+
+def audio_prefix_frames(nchannels):
+    """Frames holding the 1-LSB `MAGIC_V2` + mode prefix, rounded to a byte boundary."""
+    frames = -(-AUDIO_PREFIX_BITS // nchannels)
+    while (frames * nchannels) % 8:
+        frames += 1
+    return frames
+
+def embed(cover_wav_path, secret_path, out_wav_path, chunk_frames=AUDIO_CHUNK_FRAMES, lsbs=1, workers=1):
     import wave
-    cover = wave.open(cover_wav_path, "rb")
-    params = cover.getparams()
-    nchannels, sampwidth, framerate, nframes = params.nchannels, params.sampwidth, params.framerate, params.nframes
-    if sampwidth != 2:
-        print("Tool expects 16-bit WAV.")
-        cover.close(); return
-    samples_count = nframes * nchannels
-    capacity_bits = samples_count
-    secret_bytes = Path(secret_path).read_bytes()
+    if workers > 1:
+        return embed_parallel(cover_wav_path, secret_path, out_wav_path, lsbs, workers)
+    with wave.open(cover_wav_path, "rb") as cover:
+        return embed_frames(cover, secret_path, out_wav_path, chunk_frames, lsbs)
+
+def _audio_layout(params, secret_path, lsbs):
+    """(prefix frames, header, payload length) for hiding `secret_path` in a cover with
+    wave-style `params`, or None once the reason it can't be done is printed."""
+    if not 1 <= lsbs <= 4:
+        print("LSBs per sample must be 1-4."); return None
+    if params.sampwidth not in (1, 2, 3, 4):
+        print("Tool expects 8/16/24/32-bit PCM WAV."); return None
+    # plain 16-bit/1-LSB keeps the original KAMIAUD1 layout so older builds can still read it
+    legacy = params.sampwidth == 2 and lsbs == 1
+    prefix_frames = 0 if legacy else audio_prefix_frames(params.nchannels)
     filename = Path(secret_path).name.encode("utf-8")
-    fname_len = len(filename)
-    payload_len = len(secret_bytes)
-    header = MAGIC + struct.pack(">I", fname_len) + filename + struct.pack(">Q", payload_len)
-    payload = header + secret_bytes
-    payload_bits = list(bytes_to_bits(payload))
-    needed = len(payload_bits)
-    if needed > capacity_bits:
-        print(f"Cover too small: need {needed} bits, capacity {capacity_bits} bits.")
-        cover.close(); return
-    raw_frames = cover.readframes(nframes)
-    cover.close()
-    total_samples = nframes * nchannels
-    fmt = "<" + ("h" * total_samples)
-    samples = list(struct.unpack(fmt, raw_frames))
-    for i, bit in enumerate(payload_bits):
-        samples[i] = (samples[i] & ~1) | bit
-    new_frames = struct.pack(fmt, *samples)
+    payload_len = os.path.getsize(secret_path)
+    header = struct.pack(">I", len(filename)) + filename + struct.pack(">Q", payload_len)
+    if legacy:
+        header = MAGIC + header
+    if params.nframes is not None:
+        needed = (len(header) + payload_len) * 8
+        capacity_bits = max(0, params.nframes - prefix_frames) * params.nchannels * lsbs
+        if needed > capacity_bits:
+            print(f"Cover too small: need {needed} bits, capacity {capacity_bits} bits.")
+            return None
+    return prefix_frames, header, payload_len
+
+def _audio_mode_prefix(raw_frames, sampwidth, lsbs):
+    """The 1-LSB MAGIC_V2 + mode prefix written into the first frames."""
+    return lsb_embed_samples(raw_frames, MAGIC_V2 + bytes([(sampwidth << 4) | lsbs]), sampwidth)
+
+def embed_frames(cover, secret_path, out_wav_path, chunk_frames=AUDIO_CHUNK_FRAMES, lsbs=1):
+    """Embed into any reader with wave-style getparams()/readframes(); nframes may be None for pipes."""
+    import wave
+    params = cover.getparams()
+    layout = _audio_layout(params, secret_path, lsbs)
+    if layout is None:
+        return False
+    prefix_frames, header, payload_len = layout
+    nchannels, sampwidth = params.nchannels, params.sampwidth
+    chunk_frames = max(8, chunk_frames - chunk_frames % 8)
     outw = wave.open(out_wav_path, "wb")
     outw.setnchannels(nchannels)
     outw.setsampwidth(sampwidth)
-    outw.setframerate(framerate)
-    outw.writeframes(new_frames)
-    outw.close()
+    outw.setframerate(params.framerate)
+    capacity_bits = 0
+    try:
+        if prefix_frames:
+            outw.writeframes(_audio_mode_prefix(cover.readframes(prefix_frames), sampwidth, lsbs))
+        pending = header
+        with open(secret_path, "rb") as secret:
+            while True:
+                raw_frames = cover.readframes(chunk_frames)
+                if not raw_frames:
+                    break
+                want = len(raw_frames) // sampwidth * lsbs // 8
+                capacity_bits += want * 8
+                if len(pending) < want:
+                    pending += secret.read(want - len(pending))
+                chunk, pending = pending[:want], pending[want:]
+                if chunk:
+                    raw_frames = lsb_embed_samples(raw_frames, chunk, sampwidth, lsbs)
+                outw.writeframes(raw_frames)
+            short = bool(pending or secret.read(1))
+    finally:
+        outw.close()
+    if short:
+        # only reachable when the frame count was not known up front
+        os.remove(out_wav_path)
+        print(f"Cover too small: need {(len(header) + payload_len) * 8} bits, capacity {capacity_bits} bits.")
+        return False
+    print(f"Embedded {secret_path} into {out_wav_path}")
+    return True
+
+def embed_parallel(cover_wav_path, secret_path, out_wav_path, lsbs=1, workers=2):
+    """embed() on a process pool: the output gets its WAV header up front, then each
+    job copies one slice of the cover's samples, embeds its part of the payload and
+    writes the slice at the same offset, so every byte is read and written once."""
+    import wave
+    with wave.open(cover_wav_path, "rb") as cover:
+        params = cover.getparams()
+        prefix = cover.readframes(audio_prefix_frames(params.nchannels))
+    layout = _audio_layout(params, secret_path, lsbs)
+    if layout is None:
+        return False
+    prefix_frames, header, payload_len = layout
+    nchannels, sampwidth, nframes = params.nchannels, params.sampwidth, params.nframes
+    cover_offset, _ = wav_data_offset(cover_wav_path)
+    size = nframes * nchannels * sampwidth
+    with open(out_wav_path, "wb") as f:
+        f.write(struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + size + (size & 1), b"WAVE", b"fmt ", 16, 1,
+                            nchannels, params.framerate, params.framerate * nchannels * sampwidth,
+                            nchannels * sampwidth, sampwidth * 8, b"data", size))
+        out_offset = f.tell()
+        if prefix_frames:
+            f.write(_audio_mode_prefix(prefix[:prefix_frames * nchannels * sampwidth], sampwidth, lsbs))
+        f.truncate(out_offset + size + (size & 1))
+    # slices of whole samples holding a whole number of payload bytes
+    sample0 = prefix_frames * nchannels
+    step = max(8, PARALLEL_SPAN_BYTES // sampwidth // 8 * 8)
+    total = nframes * nchannels - sample0
+    payload_total = len(header) + payload_len
+    jobs = [(cover_wav_path, cover_offset, out_wav_path, out_offset, sampwidth, lsbs, sample0, a, min(total, a + step),
+             header, secret_path, payload_total) for a in range(0, total, step)]
+    try:
+        for _ in run_spans(_audio_embed_span, jobs, workers):
+            pass
+    except BaseException:
+        os.remove(out_wav_path)
+        raise
     print(f"Embedded {secret_path} into {out_wav_path}")
+    return True
 
-def extract_audio(stego_wav_path, out_folder):
+def extract_audio(stego_wav_path, out_folder, chunk_frames=AUDIO_CHUNK_FRAMES, workers=1):
     import wave
     if not os.path.exists(stego_wav_path):
         print("File not found."); return
     wf = wave.open(stego_wav_path, "rb")
     nchannels, sampwidth, framerate, nframes = wf.getnchannels(), wf.getsampwidth(), wf.getframerate(), wf.getnframes()
-    if sampwidth != 2:
-        print("Expecting 16-bit WAV."); wf.close(); return
-    raw = wf.readframes(nframes); wf.close()
-    total_samples = nframes * nchannels
-    fmt = "<" + ("h" * total_samples)
-    samples = list(struct.unpack(fmt, raw))
-    bits = [s & 1 for s in samples]
-    stream_bytes = bits_to_bytes(bits)
-    if len(stream_bytes) < 8+4+8:
-        print("No payload found."); return
-    if stream_bytes[0:8] != MAGIC:
+    if sampwidth not in (1, 2, 3, 4):
+        print("Expecting 8/16/24/32-bit PCM WAV."); wf.close(); return
+    chunk_frames = max(8, chunk_frames - chunk_frames % 8)
+    # the first 8 bytes are always 1-LSB and tell the layout apart
+    prefix = lsb_extract_samples(wf.readframes(audio_prefix_frames(nchannels)), sampwidth)
+    if len(prefix) < 8:
+        print("No payload found."); wf.close(); return
+    # stream_bytes[0] sits at byte `base` of the bit stream that starts at sample `sample0`
+    if prefix[0:8] == MAGIC and sampwidth == 2:
+        lsbs = 1
+        stream_bytes = prefix[8:]
+        sample0, base = 0, 8
+    elif prefix[0:8] == MAGIC_V2 and len(prefix) > 8 and prefix[8] >> 4 == sampwidth and 1 <= prefix[8] & 0x0F <= 4:
+        lsbs = prefix[8] & 0x0F
+        stream_bytes = b""
+        sample0, base = audio_prefix_frames(nchannels) * nchannels, 0
+    else:
         print("Magic not found; no hidden data.")
-        return
-    idx = 8
+        wf.close(); return
+    # header is parsed from the first blocks; the secret is then streamed to disk
+    header_len = None
+    while True:
+        if len(stream_bytes) >= 4:
+            fname_len = struct.unpack(">I", stream_bytes[0:4])[0]
+            if len(stream_bytes) >= 4+fname_len+8:
+                header_len = 4+fname_len+8
+                break
+        raw = wf.readframes(chunk_frames)
+        if not raw:
+            break
+        stream_bytes += lsb_extract_samples(raw, sampwidth, lsbs)
+    if header_len is None:
+        print("Incomplete payload."); wf.close(); return
+    idx = 0
     fname_len = struct.unpack(">I", stream_bytes[idx:idx+4])[0]; idx += 4
-    filename = stream_bytes[idx:idx+fname_len].decode("utf-8"); idx += fname_len
+    filename = stream_bytes[idx:idx+fname_len].decode("utf-8", errors="replace"); idx += fname_len
     payload_len = struct.unpack(">Q", stream_bytes[idx:idx+8])[0]; idx += 8
-    total_needed = 8 + 4 + fname_len + 8 + payload_len
-    if len(stream_bytes) < total_needed:
+    # the stored name comes from the cover, so it never picks the directory
+    name = os.path.basename(filename.replace("\\", "/"))
+    out_path = Path(out_folder) / (name if name not in ("", ".", "..") else "extracted_secret.bin")
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    part_path = out_path.with_name(out_path.name + ".part")
+    remaining = payload_len
+    if workers > 1:
+        wf.close()
+        start = base + header_len
+        if (start + payload_len) * 8 > (nframes * nchannels - sample0) * lsbs:
+            print("Incomplete payload."); return
+        data_offset, _ = wav_data_offset(stego_wav_path)
+        spans = span_jobs(start, start + payload_len, align=lsbs)
+        jobs = [(stego_wav_path, data_offset, sampwidth, lsbs, sample0, pos, length) for pos, length, _ in spans]
+        with open(part_path, "wb") as f:
+            for (_, _, skip), data in zip(spans, run_spans(_audio_extract_span, jobs, workers)):
+                f.write(data[skip:])
+        os.replace(part_path, out_path)
+        print(f"Extracted hidden file to: {out_path}")
+        return out_path
+    with open(part_path, "wb") as f:
+        data = stream_bytes[idx:idx+remaining]
+        while True:
+            f.write(data)
+            remaining -= len(data)
+            if remaining <= 0:
+                break
+            raw = wf.readframes(chunk_frames)
+            if not raw:
+                break
+            data = lsb_extract_samples(raw, sampwidth, lsbs)[:remaining]
+    wf.close()
+    if remaining > 0:
+        os.remove(part_path)
         print("Incomplete payload.")
         return
-    secret = stream_bytes[idx:idx+payload_len]
-    out_path = Path(out_folder) / filename
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(out_path, "wb") as f:
-        f.write(secret)
+    os.replace(part_path, out_path)
     print(f"Extracted hidden file to: {out_path}")
+    return out_path
 
-def embed_audio_wrapper(cover, secret, out):
+def embed_audio_wrapper(cover, secret, out, lsbs=1, piped=True, workers=1):
     if not os.path.exists(cover):
         print("Cover not found."); return
-    temp_wav = None
-    used_cover = cover
-    if not cover.lower().endswith(".wav"):
-        if not has_ffmpeg():
-            print("Cover not WAV and ffmpeg not found. Install ffmpeg or provide WAV.")
-            return
-        temp_wav = ".__tmp_cover.wav"
+    if cover.lower().endswith(".wav"):
+        return embed(cover, secret, out, lsbs=lsbs, workers=workers)
+    if not has_ffmpeg():
+        print("Cover not WAV and ffmpeg not found. Install ffmpeg or provide WAV.")
+        return
+    if piped:
+        # decode and embed concurrently; no temp file touches disk
+        try:
+            with FFmpegPCMReader(cover) as reader:
+                return embed_frames(reader, secret, out, lsbs=lsbs)
+        except (OSError, subprocess.CalledProcessError):
+            if os.path.exists(out):
+                os.remove(out)
+            print("Conversion failed.")
+        return
+    fd, temp_wav = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    try:
         ok = convert_to_wav(cover, temp_wav)
         if not ok:
             print("Conversion failed."); return
-        used_cover = temp_wav
-    try:
-        embed(used_cover, secret, out)
+        return embed(temp_wav, secret, out, lsbs=lsbs, workers=workers)
     finally:
-        if temp_wav and os.path.exists(temp_wav):
+        if os.path.exists(temp_wav):
             os.remove(temp_wav)
 
 # ---------------- Image stego ----------------
@@ -433,58 +1348,679 @@ def image_stego_menu():
             img = input("Cover image path (PNG): ").strip()
             secret = input("Secret file path: ").strip()
             out = input("Output image name (default stego_image.png): ").strip() or "stego_image.png"
-            hide_file_in_image(img, secret, out)
+            legacy = input("Legacy terminator format? (y/N): ").strip().lower() == "y"
+            tiled = not legacy and input("Tiled mode for very large covers? (y/N): ").strip().lower() == "y"
+            if tiled:
+                hide_file_in_image_tiled(img, secret, out)
+            else:
+                workers = input("Worker processes (default 1): ").strip() or "1"
+                if not workers.isdigit() or int(workers) < 1:
+                    print("Invalid worker count."); continue
+                hide_file_in_image(img, secret, out, legacy=legacy, workers=int(workers))
         elif ch == "2":
             stego = input("Stego image path: ").strip()
-            outf = input("Output file name (default extracted_secret.bin): ").strip() or "extracted_secret.bin"
-            extract_file_from_image(stego, outf)
+            outf = input("Output file name (default stored name / extracted_secret.bin): ").strip() or None
+            tiled = input("Tiled mode for very large images? (y/N): ").strip().lower() == "y"
+            if tiled:
+                extract_file_from_image_tiled(stego, outf)
+            else:
+                workers = input("Worker processes (default 1): ").strip() or "1"
+                if not workers.isdigit() or int(workers) < 1:
+                    print("Invalid worker count."); continue
+                extract_file_from_image(stego, outf, workers=int(workers))
         elif ch == "3":
             break
         else:
             print("Invalid choice.")
 
-def hide_file_in_image(image_path, secret_path, output_path="stego_image.png"):
+# length-prefixed container: magic, >I name len, name, >Q payload len, >I crc32, payload
+IMG_MAGIC = b"KAMIIMG1"
+# legacy 16-bit end marker "1111111111111110" appended after the secret bits
+IMG_TERMINATOR = b"\xff\xfe"
+IMG_TERMINATOR_BITS = b"1111111111111110"
+# pixels decoded per step while scanning for the terminator
+IMG_CHUNK_PIXELS = 1 << 20
+# maps a byte to b"0"/b"1" by its LSB, and b"0"/b"1" back to 0/1
+_LSB_CHARS = bytes(48 + (i & 1) for i in range(256))
+_CHAR_BITS = bytes(i - 48 if i in (48, 49) else 0 for i in range(256))
+
+def _rgb_lsb_write(px, pix_start, payload, nbits):
+    """NumPy core: write the first `nbits` payload bits into px[pix_start:] (an N x 4 uint8 view)."""
+    npix = -(-nbits // 3)
+    bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8))[:nbits]
+    rgb = px[pix_start:pix_start + npix, :3].reshape(-1)
+    rgb[:nbits] = (rgb[:nbits] & 0xFE) | bits
+    px[pix_start:pix_start + npix, :3] = rgb.reshape(-1, 3)
+
+def _rgb_lsb_read(px, pix_start, nbytes):
+    """NumPy core: read `nbytes` from the R, G, B LSBs of px[pix_start:] (partial byte dropped)."""
+    nbits = nbytes * 8
+    bits = (px[pix_start:pix_start + -(-nbits // 3), :3] & 1).reshape(-1)[:nbits]
+    return np.packbits(bits[:len(bits) - len(bits) % 8]).tobytes()
+
+def image_lsb_embed(img, payload, use_numpy=NUMPY_OK):
+    """Write payload bits (MSB first) into the R, G, B LSBs of an RGBA image, pixel by pixel."""
+    nbits = min(len(payload) * 8, img.size[0] * img.size[1] * 3)
+    npix = -(-nbits // 3)
+    if use_numpy:
+        arr = np.array(img, dtype=np.uint8)
+        _rgb_lsb_write(arr.reshape(-1, 4), 0, payload, nbits)
+        return Image.fromarray(arr, "RGBA")
+    raw = bytearray(img.tobytes())
+    rgb = bytearray(npix * 3)
+    for c in range(3):
+        rgb[c::3] = raw[c:npix * 4:4]
+    # 0/1 bytes OR'd onto LSB-cleared bytes as big ints: a bytewise OR without a Python loop
+    bits = format(int.from_bytes(payload, "big"), f"0{len(payload) * 8}b").encode()[:nbits].translate(_CHAR_BITS)
+    cleared = bytes(rgb[:nbits]).translate(bytes(i & 0xFE for i in range(256)))
+    rgb[:nbits] = (int.from_bytes(cleared, "big") | int.from_bytes(bits, "big")).to_bytes(nbits, "big")
+    for c in range(3):
+        raw[c:npix * 4:4] = rgb[c::3]
+    return Image.frombytes("RGBA", img.size, bytes(raw))
+
+def image_lsb_extract(img, use_numpy=NUMPY_OK):
+    """Read R, G, B LSBs up to the first terminator (at any bit offset); trailing partial byte dropped."""
+    if use_numpy:
+        px = np.asarray(img, dtype=np.uint8).reshape(-1, 4)
+        chunks = []
+        nbits = 0
+        eof = -1
+        last_zero = -1
+        for start in range(0, len(px), IMG_CHUNK_PIXELS):
+            bits = (px[start:start + IMG_CHUNK_PIXELS, :3] & 1).reshape(-1)
+            chunks.append(bits)
+            # a terminator ends at a 0 preceded by at least 15 ones
+            zeros = np.flatnonzero(bits == 0) + nbits
+            if len(zeros):
+                runs = np.diff(zeros, prepend=last_zero)
+                hit = np.flatnonzero(runs >= 16)
+                if len(hit):
+                    eof = int(zeros[hit[0]]) - 15
+                    break
+                last_zero = int(zeros[-1])
+            nbits += len(bits)
+        bits = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.uint8)
+        if eof != -1:
+            bits = bits[:eof]
+        bits = bits[:len(bits) - len(bits) % 8]
+        return np.packbits(bits).tobytes()
+    raw = img.tobytes()
+    rgb = bytearray(len(raw) // 4 * 3)
+    for c in range(3):
+        rgb[c::3] = raw[c::4]
+    bits = bytes(rgb).translate(_LSB_CHARS)
+    eof = bits.find(IMG_TERMINATOR_BITS)
+    if eof != -1:
+        bits = bits[:eof]
+    n = len(bits) // 8
+    return int(bits[:n * 8], 2).to_bytes(n, "big") if n else b""
+
+def image_lsb_read(img, nbytes, use_numpy=NUMPY_OK):
+    """Read the first `nbytes` hidden in the R, G, B LSBs, touching only the rows that hold them."""
+    w, h = img.size
+    nbits = min(nbytes * 8, w * h * 3)
+    npix = -(-nbits // 3)
+    rows = -(-npix // w) if w else 0
+    band = img if rows == h else img.crop((0, 0, w, rows))
+    if band.mode != "RGBA":
+        band = band.convert("RGBA")
+    if use_numpy:
+        return _rgb_lsb_read(np.asarray(band, dtype=np.uint8).reshape(-1, 4), 0, nbits // 8)
+    raw = band.tobytes()
+    rgb = bytearray(npix * 3)
+    for c in range(3):
+        rgb[c::3] = raw[c:npix * 4:4]
+    n = nbits // 8
+    return int(bytes(rgb[:n * 8]).translate(_LSB_CHARS), 2).to_bytes(n, "big") if n else b""
+
+def _image_to_memmap(img):
+    """Copy an RGBA image into a temp-file memmap that pool workers can open by path."""
+    fd, path = tempfile.mkstemp(suffix=".rgba")
+    os.close(fd)
+    shape = (img.size[0] * img.size[1], 4)
+    px = np.memmap(path, dtype=np.uint8, mode="w+", shape=shape)
+    px[:] = np.asarray(img, dtype=np.uint8).reshape(shape)
+    px.flush()
+    return path, shape, px
+
+def _image_extract_span(buf_path, shape, start, length):
+    """Pool job: read one payload span from the shared pixel memmap."""
+    px = np.memmap(buf_path, dtype=np.uint8, mode="r", shape=shape)
+    return _rgb_lsb_read(px, start * 8 // 3, length)
+
+def hide_file_in_image(image_path, secret_path, output_path="stego_image.png", legacy=False, workers=1):
+    """With workers > 1 the container format goes through the band-streaming writer
+    (same pixels), which embeds and compresses bands on a process pool."""
+    if workers > 1 and not legacy:
+        return hide_file_in_image_tiled(image_path, secret_path, output_path, workers=workers)
     with open(secret_path, "rb") as f:
         secret_data = f.read()
     img = Image.open(image_path).convert("RGBA")
-    pixels = list(img.getdata())
-    secret_bits = ''.join(format(byte, '08b') for byte in secret_data) + "1111111111111110"
-    new_pixels = []
-    bit_index = 0
-    for pixel in pixels:
-        r, g, b, a = pixel
-        if bit_index < len(secret_bits):
-            r = (r & ~1) | int(secret_bits[bit_index]); bit_index += 1
-        if bit_index < len(secret_bits):
-            g = (g & ~1) | int(secret_bits[bit_index]); bit_index += 1
-        if bit_index < len(secret_bits):
-            b = (b & ~1) | int(secret_bits[bit_index]); bit_index += 1
-        new_pixels.append((r, g, b, a))
-    img.putdata(new_pixels)
+    if legacy:
+        payload = secret_data + IMG_TERMINATOR
+    else:
+        filename = Path(secret_path).name.encode("utf-8")
+        payload = (IMG_MAGIC + struct.pack(">I", len(filename)) + filename
+                   + struct.pack(">QI", len(secret_data), zlib.crc32(secret_data)) + secret_data)
+        capacity_bits = img.size[0] * img.size[1] * 3
+        if len(payload) * 8 > capacity_bits:
+            print(f"Cover too small: need {len(payload) * 8} bits, capacity {capacity_bits} bits.")
+            return
+    img = image_lsb_embed(img, payload)
     img.save(output_path, "PNG")
     print(f"File hidden inside {output_path}")
+    return True
 
-def extract_file_from_image(stego_image, output_path="extracted_secret.bin"):
-    img = Image.open(stego_image)
-    pixels = list(img.getdata())
-    bits = ""
-    for pixel in pixels:
-        r, g, b, a = pixel
-        bits += str(r & 1); bits += str(g & 1); bits += str(b & 1)
-    eof = bits.find("1111111111111110")
-    if eof != -1:
-        bits = bits[:eof]
-    secret_bytes = bytearray()
-    for i in range(0, len(bits), 8):
-        byte = bits[i:i+8]
-        if len(byte) == 8:
-            secret_bytes.append(int(byte, 2))
+def _extract_legacy_image(stego_image, output_path=None):
+    """Terminator format: decode until the 16-bit end marker."""
+    secret_bytes = image_lsb_extract(Image.open(stego_image).convert("RGBA"))
+    output_path = output_path or "extracted_secret.bin"
     with open(output_path, "wb") as f:
         f.write(secret_bytes)
     print(f"Hidden file extracted as {output_path}")
+    return output_path
+
+def extract_file_from_image(stego_image, output_path=None, workers=1):
+    """Streams the image band by band (see extract_file_from_image_tiled); with
+    `workers` > 1 only the header is streamed and the payload span is read in parallel."""
+    if workers <= 1 or not NUMPY_OK:
+        return extract_file_from_image_tiled(stego_image, output_path)
+    bands = iter_image_bands(stego_image)
+    stream_bytes, header_len = _read_image_header(bands)
+    bands.close()
+    if stream_bytes[0:8] != IMG_MAGIC:
+        return _extract_legacy_image(stego_image, output_path)
+    if header_len is None:
+        print("Incomplete payload."); return
+    fname_len = header_len - 24
+    filename = stream_bytes[12:12+fname_len].decode("utf-8", errors="replace")
+    payload_len, crc = struct.unpack(">QI", stream_bytes[12+fname_len:header_len])
+    img = Image.open(stego_image)
+    if header_len + payload_len > img.size[0] * img.size[1] * 3 // 8:
+        print("Incomplete payload."); return
+    buf_path, shape, px = _image_to_memmap(img.convert("RGBA"))
+    try:
+        spans = span_jobs(header_len, header_len + payload_len, align=3)
+        jobs = [(buf_path, shape, pos, length) for pos, length, _ in spans]
+        secret_bytes = b"".join(data[skip:] for (_, _, skip), data in
+                                zip(spans, run_spans(_image_extract_span, jobs, workers)))
+    finally:
+        del px
+        os.remove(buf_path)
+    if zlib.crc32(secret_bytes) != crc:
+        print("Checksum mismatch; hidden data is corrupted."); return
+    output_path = output_path or os.path.basename(filename) or "extracted_secret.bin"
+    with open(output_path + ".part", "wb") as f:
+        f.write(secret_bytes)
+    os.replace(output_path + ".part", output_path)
+    print(f"Hidden file extracted as {output_path}")
+    return output_path
+
+# ---- tiled mode: row bands streamed through a minimal PNG reader/writer ----
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# rows per band; a multiple of 8 keeps every band's bit span byte-aligned
+IMG_BAND_ROWS = 256
+# cap on decompressed bytes held at once while inflating IDAT data
+PNG_INFLATE_STEP = 1 << 22
+
+def _png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+def _png_decode_rows(width, color_type, prev_row, filtered):
+    """Unfilter raw scanlines by handing them to Pillow as a tiny PNG seeded with the previous row."""
+    ihdr = struct.pack(">IIBBBBB", width, len(filtered) // (len(prev_row) + 1) + 1, 8, color_type, 0, 0, 0)
+    data = PNG_SIGNATURE + _png_chunk(b"IHDR", ihdr)
+    data += _png_chunk(b"IDAT", zlib.compress(b"\0" + prev_row + filtered, 0)) + _png_chunk(b"IEND", b"")
+    band = Image.open(io.BytesIO(data))
+    band.load()
+    return band.crop((0, 1, band.size[0], band.size[1]))
+
+def iter_image_bands(path, band_rows=IMG_BAND_ROWS):
+    """Yield the image as RGBA bands of `band_rows` rows.
+
+    8-bit non-interlaced RGB/RGBA PNGs are inflated incrementally, so only one band is
+    ever decoded at a time. Anything else is loaded whole by Pillow and sliced.
+    """
+    with open(path, "rb") as f:
+        streamable = f.read(8) == PNG_SIGNATURE
+        if streamable:
+            length, tag = struct.unpack(">I4s", f.read(8))
+            w, h, depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", f.read(length)[:13])
+            f.read(4)
+            streamable = tag == b"IHDR" and depth == 8 and color_type in (2, 6) and not interlace
+        if streamable:
+            stride = w * (3 if color_type == 2 else 4) + 1
+            prev_row = bytes(stride - 1)
+            inflater = zlib.decompressobj()
+            pending = bytearray()
+            emitted = 0
+            while emitted < h:
+                head = f.read(8)
+                if len(head) < 8:
+                    break
+                length, tag = struct.unpack(">I4s", head)
+                data = f.read(length); f.read(4)
+                if tag == b"IEND":
+                    data = b""
+                elif tag != b"IDAT":
+                    continue
+                while True:
+                    pending += inflater.decompress(data, PNG_INFLATE_STEP)
+                    data = inflater.unconsumed_tail
+                    while len(pending) >= band_rows * stride or (tag == b"IEND" and pending):
+                        rows = min(band_rows, len(pending) // stride, h - emitted)
+                        if rows <= 0:
+                            break
+                        band = _png_decode_rows(w, color_type, prev_row, bytes(pending[:rows * stride]))
+                        del pending[:rows * stride]
+                        prev_row = band.crop((0, rows - 1, w, rows)).tobytes()
+                        emitted += rows
+                        yield band.convert("RGBA")
+                    if not data:
+                        break
+                if tag == b"IEND":
+                    break
+            return
+    img = Image.open(path)
+    w, h = img.size
+    for y in range(0, h, band_rows):
+        yield img.crop((0, y, w, min(h, y + band_rows))).convert("RGBA")
+
+def _adler32_combine(adler1, adler2, len2):
+    """Adler-32 of A + B from those of A and B (zlib's adler32_combine)."""
+    base = 65521
+    rem = len2 % base
+    sum1 = ((adler1 & 0xFFFF) + (adler2 & 0xFFFF) + base - 1) % base
+    sum2 = (rem * (adler1 & 0xFFFF) + (adler1 >> 16) + (adler2 >> 16) + base - rem) % base
+    return sum1 | (sum2 << 16)
+
+def _png_deflate_band(rgba, width, chunk, level):
+    """Pool job: embed `chunk` into an RGBA band, then deflate its unfiltered rows as a
+    raw, sync-flushed piece of the PNG's zlib stream (see PNGStreamWriter.write_deflated)."""
+    if chunk:
+        rgba = image_lsb_embed(Image.frombytes("RGBA", (width, len(rgba) // (width * 4)), rgba), chunk).tobytes()
+    stride = width * 4
+    rows = b"".join(b"\0" + rgba[i:i + stride] for i in range(0, len(rgba), stride))
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(rows) + compressor.flush(zlib.Z_SYNC_FLUSH), zlib.adler32(rows), len(rows)
+
+class PNGStreamWriter:
+    """Writes an RGBA PNG row band by row band; rows are stored unfiltered. Bands come
+    either as pixels (write_rows) or already deflated in order by _png_deflate_band
+    (write_deflated), never both."""
+    def __init__(self, path, width, height, level=6):
+        self.path = path
+        self.f = open(path, "wb")
+        self.width = width
+        self.level = level
+        self.compressor = zlib.compressobj(level)
+        self.adler = None  # running Adler-32 of the rows passed to write_deflated
+        self.f.write(PNG_SIGNATURE + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+    def write_rows(self, rgba):
+        stride = self.width * 4
+        rows = b"".join(b"\0" + rgba[i:i + stride] for i in range(0, len(rgba), stride))
+        data = self.compressor.compress(rows)
+        if data:
+            self.f.write(_png_chunk(b"IDAT", data))
+    def write_deflated(self, data, adler, length):
+        if self.adler is None:
+            data = b"\x78\x9c" + data  # zlib header; the pieces are raw deflate
+            self.adler = adler
+        else:
+            self.adler = _adler32_combine(self.adler, adler, length)
+        self.f.write(_png_chunk(b"IDAT", data))
+    def close(self):
+        if self.adler is None:
+            tail = self.compressor.flush()
+        else:
+            tail = b"\x03\x00" + struct.pack(">I", self.adler)  # empty final block, then the checksum
+        self.f.write(_png_chunk(b"IDAT", tail) + _png_chunk(b"IEND", b""))
+        self.f.close()
+    def abort(self):
+        """Close without finishing the PNG and delete what was written."""
+        self.f.close()
+        os.remove(self.path)
+
+def hide_file_in_image_tiled(image_path, secret_path, output_path="stego_image.png", band_rows=IMG_BAND_ROWS,
+                             workers=1):
+    """Same pixel layout as the container format, built band by band with bounded memory.
+    With workers > 1, bands are embedded and compressed on a process pool as they are
+    decoded, with a few in flight per worker."""
+    band_rows = max(8, band_rows - band_rows % 8)
+    w, h = Image.open(image_path).size
+    crc = 0
+    with open(secret_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            crc = zlib.crc32(block, crc)
+    filename = Path(secret_path).name.encode("utf-8")
+    payload_len = os.path.getsize(secret_path)
+    header = IMG_MAGIC + struct.pack(">I", len(filename)) + filename + struct.pack(">QI", payload_len, crc)
+    capacity_bits = w * h * 3
+    needed = (len(header) + payload_len) * 8
+    if needed > capacity_bits:
+        print(f"Cover too small: need {needed} bits, capacity {capacity_bits} bits.")
+        return
+    # built under .part and renamed when complete, so a failure never leaves a PNG
+    # that opens fine but is missing rows or payload
+    writer = PNGStreamWriter(output_path + ".part", w, h)
+    pool = make_pool(workers)
+    inflight = collections.deque()
+    pending = header
+    rows = 0
+    try:
+        with open(secret_path, "rb") as secret:
+            # payload fills bands in raster order, so the output also decodes without tiling
+            for band in iter_image_bands(image_path, band_rows):
+                want = band.size[0] * band.size[1] * 3 // 8
+                if len(pending) < want:
+                    pending += secret.read(want - len(pending))
+                chunk, pending = pending[:want], pending[want:]
+                rows += band.size[1]
+                if pool is None:
+                    if chunk:
+                        band = image_lsb_embed(band, chunk)
+                    writer.write_rows(band.tobytes())
+                    continue
+                inflight.append(pool.submit(_png_deflate_band, band.tobytes(), w, chunk, writer.level))
+                if len(inflight) > 2 * workers:
+                    writer.write_deflated(*inflight.popleft().result())
+            while inflight:
+                writer.write_deflated(*inflight.popleft().result())
+            short = pending or secret.tell() < payload_len
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    if rows != h or short:
+        writer.abort()
+        print("Cover image or secret file ended early; nothing written.")
+        return
+    writer.close()
+    os.replace(writer.path, output_path)
+    print(f"File hidden inside {output_path}")
+    return True
+
+def _band_lsb_read(band, nbytes=None):
+    """The bytes hidden in one band (all of them, or the first `nbytes`)."""
+    capacity = band.size[0] * band.size[1] * 3 // 8
+    return image_lsb_read(band, capacity if nbytes is None else min(nbytes, capacity))
+
+def _read_image_header(bands):
+    """Read hidden bytes from `bands` until the container header is complete.
+    Returns (bytes read, header length); the length is None if the bands ran out
+    first, and the bytes don't start with IMG_MAGIC for a terminator-format image."""
+    stream_bytes = b""
+    for band in bands:
+        stream_bytes += _band_lsb_read(band)
+        if len(stream_bytes) >= 8 and stream_bytes[0:8] != IMG_MAGIC:
+            break
+        if len(stream_bytes) >= 12:
+            header_len = 12 + struct.unpack(">I", stream_bytes[8:12])[0] + 12
+            if len(stream_bytes) >= header_len:
+                return stream_bytes, header_len
+    return stream_bytes, None
+
+def extract_file_from_image_tiled(stego_image, output_path=None, band_rows=IMG_BAND_ROWS):
+    """One pass over the image band by band, stopping at the band where the payload
+    ends; the file is written under .part and renamed once its CRC checks out."""
+    band_rows = max(8, band_rows - band_rows % 8)
+    bands = iter_image_bands(stego_image, band_rows)
+    stream_bytes, header_len = _read_image_header(bands)
+    if stream_bytes[0:8] != IMG_MAGIC:
+        bands.close()
+        return _extract_legacy_image(stego_image, output_path)
+    if header_len is None:
+        print("Incomplete payload."); return
+    fname_len = header_len - 24
+    filename = stream_bytes[12:12+fname_len].decode("utf-8", errors="replace")
+    payload_len, crc = struct.unpack(">QI", stream_bytes[12+fname_len:header_len])
+    w, h = Image.open(stego_image).size
+    if header_len + payload_len > w * h * 3 // 8:
+        bands.close()
+        print("Incomplete payload."); return
+    output_path = output_path or os.path.basename(filename) or "extracted_secret.bin"
+    part_path = output_path + ".part"
+    remaining = payload_len
+    got_crc = 0
+    with open(part_path, "wb") as f:
+        data = stream_bytes[header_len:header_len+remaining]
+        while True:
+            f.write(data)
+            got_crc = zlib.crc32(data, got_crc)
+            remaining -= len(data)
+            if remaining <= 0:
+                break
+            band = next(bands, None)
+            if band is None:
+                break
+            data = _band_lsb_read(band, remaining)
+    bands.close()
+    if remaining > 0 or got_crc != crc:
+        os.remove(part_path)
+        print("Incomplete payload." if remaining > 0 else "Checksum mismatch; hidden data is corrupted.")
+        return
+    os.replace(part_path, output_path)
+    print(f"Hidden file extracted as {output_path}")
+    return output_path
+
+# ---------------- Batch stego runner ----------------
+STEGO_MODES = ("audio-embed", "audio-extract", "image-embed", "image-extract")
+
+def load_manifest(path):
+    """Read stego jobs (mode, cover, secret, output[, lsbs]) from a CSV with a header row or JSONL.
+    JSONL lines that are not a JSON object are skipped with their line number printed."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.lower().endswith((".jsonl", ".json")):
+            rows = []
+            for n, line in enumerate(f, 1):
+                if not line.strip() or line.startswith("#"):
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    print(f"[skipped] {path}:{n}: {e}"); continue
+                if not isinstance(row, dict):
+                    print(f"[skipped] {path}:{n}: not a JSON object"); continue
+                rows.append(row)
+        else:
+            import csv
+            rows = list(csv.DictReader(line for line in f if not line.startswith("#")))
+    # blank cells count as missing, so column defaults apply
+    return [{k.strip(): str(v).strip() for k, v in row.items() if k and v is not None and str(v).strip()} for row in rows]
+
+def _job_key(job):
+    return "|".join(job.get(k, "") for k in ("mode", "cover", "secret", "output"))
+
+def _job_signature(job):
+    sig = []
+    for k in ("cover", "secret"):
+        path = job.get(k)
+        if path and os.path.exists(path):
+            st = os.stat(path)
+            sig.append([st.st_size, st.st_mtime_ns])
+        else:
+            sig.append(None)
+    return sig
+
+def job_up_to_date(job, done):
+    """True if a previous run recorded this job as ok for the same inputs and its result still exists.
+
+    An output file alone proves nothing: a run that crashed mid-write leaves one newer than its inputs.
+    """
+    rec = done.get(_job_key(job))
+    return bool(rec and rec.get("status") == "ok" and rec.get("sig") == _job_signature(job)
+                and rec.get("result") and os.path.exists(rec["result"]))
+
+def run_stego_job(job):
+    """Run one manifest job with its console output captured; returns the result record."""
+    buf = io.StringIO()
+    mode = job.get("mode")
+    result = None
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(buf):
+            if mode == "audio-embed":
+                lsbs = job.get("lsbs") or "1"
+                if lsbs.isdigit():
+                    ok = embed_audio_wrapper(job["cover"], job["secret"], job["output"], int(lsbs))
+                    result = job["output"] if ok else None
+                else:
+                    print("Invalid LSB count.")
+            elif mode == "audio-extract":
+                result = extract_audio(job["cover"], job.get("output") or ".")
+            elif mode == "image-embed":
+                out = job.get("output") or "stego_image.png"
+                result = out if hide_file_in_image(job["cover"], job["secret"], out) else None
+            elif mode == "image-extract":
+                result = extract_file_from_image(job["cover"], job.get("output") or None)
+            else:
+                print(f"Unknown mode: {mode} (expected one of {', '.join(STEGO_MODES)})")
+    except Exception as e:
+        buf.write(f"{type(e).__name__}: {e}\n")
+    lines = buf.getvalue().strip().splitlines()
+    return {"key": _job_key(job), "mode": mode, "cover": job.get("cover"), "output": job.get("output"),
+            "status": "ok" if result else "failed", "seconds": round(time.perf_counter() - start, 3),
+            "message": lines[-1] if lines else "", "result": str(result) if result else None,
+            "sig": _job_signature(job)}
+
+def run_stego_batch(manifest, results_path=None, workers=None):
+    """Run a manifest across a process pool, appending one JSON record per finished job.
+
+    Jobs already recorded as ok for the same inputs are skipped, so re-running the same
+    command resumes an interrupted batch; a job that was running when it died runs again.
+    Rows run concurrently and in no fixed order, so a row must not depend on another
+    row's output.
+    """
+    if not os.path.exists(manifest):
+        print("Manifest not found."); return
+    jobs = load_manifest(manifest)
+    results_path = results_path or manifest + ".results.jsonl"
+    workers = workers or os.cpu_count() or 1
+    done = {}
+    torn = False
+    if os.path.exists(results_path):
+        with open(results_path, "r", encoding="utf-8") as f:
+            for line in f:
+                torn = not line.endswith("\n")
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # torn last line after a crash
+                done[rec.get("key")] = rec
+    todo = [job for job in jobs if not job_up_to_date(job, done)]
+    print(f"{len(jobs)} jobs, {len(jobs) - len(todo)} up to date, running {len(todo)} on {workers} worker(s)")
+    counts = {"ok": 0, "failed": 0}
+    t0 = time.perf_counter()
+    with open(results_path, "a", encoding="utf-8") as out:
+        if torn:
+            out.write("\n")  # or the first new record would be glued onto the torn one
+        def record(rec):
+            out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            out.flush()
+            counts[rec["status"]] += 1
+            print(f"[{rec['status']}] {rec['mode']} {rec['cover']} ({rec['seconds']:.2f}s) {rec['message']}")
+        pool = make_pool(workers) if len(todo) > 1 else None
+        if pool is None:
+            for job in todo:
+                record(run_stego_job(job))
+        else:
+            from concurrent.futures import as_completed
+            with pool:
+                for fut in as_completed([pool.submit(run_stego_job, job) for job in todo]):
+                    record(fut.result())
+    print(f"Done in {time.perf_counter() - t0:.1f}s: {counts['ok']} ok, {counts['failed']} failed. Results: {results_path}")
 
 # ---------------- Kamix Hollywood (simplified curses) ----------------
-def kamix_hollywood_menu():
+KAMIX_SCROLLBACK = 5000     # output lines kept for the System / Output pane
+
+class KamixJob:
+    """A shell command started from the Kamix prompt. A reader thread moves its output
+    onto `out` as (id, [lines]), a block at a time, and finishes with (id, None); the
+    UI drains that queue between frames, so drawing and typing never wait for the
+    command and a flood of output costs one queue item per read, not per line."""
+    def __init__(self, jid, cmd, out):
+        self.jid, self.cmd, self.out = jid, cmd, out
+        self.cancelled = False
+        # own session, so cancel() reaches everything the shell started too
+        self.proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                     stdin=subprocess.DEVNULL, start_new_session=os.name != "nt")
+        threading.Thread(target=self._read, daemon=True).start()
+    def _read(self):
+        fd, tail = self.proc.stdout.fileno(), b""
+        try:
+            while True:
+                data = os.read(fd, 1 << 16)
+                if not data:
+                    break
+                lines = (tail + data).split(b"\n")
+                tail = lines.pop()
+                if lines:
+                    self.out.put((self.jid, [L.decode('utf-8', errors='replace') for L in lines]))
+        except OSError:
+            pass
+        if tail:
+            self.out.put((self.jid, [tail.decode('utf-8', errors='replace')]))
+        self.proc.stdout.close()
+        self.proc.wait()
+        self.out.put((self.jid, None))
+    def cancel(self):
+        if self.proc.poll() is not None:
+            return
+        self.cancelled = True
+        try:
+            if os.name != "nt":
+                os.killpg(self.proc.pid, signal.SIGTERM)
+            else:
+                self.proc.terminate()
+        except OSError:
+            pass
+
+KAMIX_FPS = 20              # frames per second the Kamix screen is drawn at
+KAMIX_RAIN_CHARS = "01ABCDEFGHIJKLMNOPQRSTUVWXYZ@#$%&*"
+KAMIX_RAIN_POOL = 64        # precomputed rain lines; each frame shows one, rotated
+
+def kamix_rain_pool(width, rng, count=KAMIX_RAIN_POOL):
+    """`count` random rain lines `width` cells wide, about 40% blank, one choices() call per line."""
+    population = KAMIX_RAIN_CHARS + " "
+    weights = [0.6 / len(KAMIX_RAIN_CHARS)] * len(KAMIX_RAIN_CHARS) + [0.4]
+    return ["".join(rng.choices(population, weights, k=width)) for _ in range(count)]
+
+class KamixFrameClock:
+    """Paces the Kamix loop at `fps` and keeps how long each frame took to render."""
+    def __init__(self, fps=KAMIX_FPS):
+        self.fps, self.budget = fps, 1.0 / fps
+        self.next = time.perf_counter()
+        self.frames = self.over = 0
+        self.total = self.worst = 0.0
+        self.recent = collections.deque(maxlen=fps)  # last second, for the header
+        self.history = collections.deque(maxlen=10000)  # for the exit percentiles
+    def due(self):
+        return time.perf_counter() >= self.next
+    def wait_ms(self):
+        return max(0, int((self.next - time.perf_counter()) * 1000))
+    def done(self, seconds):
+        self.frames += 1; self.total += seconds; self.worst = max(self.worst, seconds)
+        self.over += seconds > self.budget
+        self.recent.append(seconds); self.history.append(seconds)
+        self.next += self.budget
+        now = time.perf_counter()
+        if self.next < now:
+            self.next = now + self.budget  # fell behind: drop frames rather than burst
+    def label(self):
+        avg = sum(self.recent) / len(self.recent) if self.recent else 0.0
+        return f" {avg * 1000:.1f}/{self.budget * 1000:.0f} ms @ {self.fps} fps "
+    def summary(self):
+        if not self.frames:
+            return "Kamix: no frames drawn."
+        times = sorted(self.history)
+        p99 = times[min(len(times) - 1, int(0.99 * len(times)))]
+        return (f"Kamix: {self.frames} frames at {self.fps} fps, render avg {self.total / self.frames * 1000:.2f} ms, "
+                f"p99 {p99 * 1000:.2f} ms, worst {self.worst * 1000:.2f} ms; "
+                f"{self.over} over the {self.budget * 1000:.0f} ms budget.")
+
+def kamix_hollywood_menu(scrollback=KAMIX_SCROLLBACK):
     try:
         import curses, math
     except Exception:
@@ -493,24 +2029,66 @@ def kamix_hollywood_menu():
     def kamix_main(stdscr):
         curses.use_default_colors()
         curses.curs_set(1)
-        stdscr.nodelay(True)
-        stdscr.timeout(90)
         curses.start_color()
         curses.init_pair(1, curses.COLOR_GREEN, -1)
         curses.init_pair(2, curses.COLOR_MAGENTA, -1)
         curses.init_pair(3, curses.COLOR_CYAN, -1)
         curses.init_pair(4, curses.COLOR_YELLOW, -1)
-        height, width = stdscr.getmaxyx()
-        top_h = max(10, height-8); mid_h = 4; bot_h = 3
-        win_top = curses.newwin(top_h, width, 0, 0)
-        win_mid = curses.newwin(mid_h, width, top_h, 0)
-        win_bot = curses.newwin(bot_h, width, top_h+mid_h, 0)
+        height = width = top_h = mid_h = 0; bot_h = 3
+        win_head = win_top = win_mid = win_bot = None
         prompt = "Kamix@Shell> "
         input_buf = ""
-        top_lines = [" " * (width-2) for _ in range(top_h-2)]
-        mid_lines = []
+        top_lines = collections.deque()  # rain rows on screen, to repaint them after a resize
+        mid_lines = collections.deque(["Commands run in the background: 'jobs' lists them, 'kill N' or Ctrl-X stops one.",
+                                       "PageUp / PageDown scroll this pane."], maxlen=scrollback)
+        scroll = 0  # output lines between the bottom of the pane and the newest line
+        jobs = {}  # id -> running KamixJob
+        job_out = queue.Queue()
+        next_jid = 1
         rng = random.Random()
+        pool = []
+        clock = KamixFrameClock()
+        head_label = None
+        mid_dirty = bot_dirty = True
+        def layout():
+            """(Re)build the windows for the current terminal size; False if it is too small."""
+            nonlocal height, width, top_h, mid_h, win_head, win_top, win_mid, win_bot, top_lines, pool, head_label
+            height, width = stdscr.getmaxyx()
+            mid_h = max(4, min(12, height // 4))
+            top_h = height - mid_h - bot_h
+            stdscr.erase(); stdscr.noutrefresh()
+            if top_h < 3 or width < 20:
+                try: stdscr.addstr(0, 0, "Terminal too small for Kamix."[:width-1])
+                except curses.error: pass
+                stdscr.noutrefresh(); curses.doupdate()
+                return False
+            # the rain spans the full width so a frame is one terminal scroll plus one new line
+            win_head = curses.newwin(1, width, 0, 0)
+            win_top = curses.newwin(top_h-1, width, 1, 0)
+            win_top.scrollok(True); win_top.idlok(True)
+            win_mid = curses.newwin(mid_h, width, top_h, 0)
+            win_bot = curses.newwin(bot_h, width, top_h+mid_h, 0)
+            win_bot.keypad(True)
+            if not pool or len(pool[0]) != width:
+                pool = kamix_rain_pool(width, rng)
+            top_lines = collections.deque(top_lines, maxlen=top_h-1)
+            for i, L in enumerate(top_lines, top_h-1-len(top_lines)):
+                try: win_top.insstr(i, 0, L[:width], curses.color_pair(1))
+                except curses.error: pass
+            win_top.noutrefresh()
+            head_label = None
+            return True
+        def draw_bot():
+            win_bot.erase(); win_bot.box()
+            try:
+                display = prompt + input_buf
+                if len(display) > width-4: display = display[-(width-4):]
+                win_bot.addstr(1,1, display, curses.color_pair(3))
+                win_bot.move(1, 1 + len(display))
+            except:
+                pass
         # small intro
+        height, width = stdscr.getmaxyx()
         title = "KAMIX HOLLYWOOD - Cinematic Shell"
         for i in range(6):
             stdscr.erase()
@@ -520,106 +2098,1504 @@ def kamix_hollywood_menu():
                 pass
             stdscr.refresh()
             time.sleep(0.12)
-        stdscr.erase(); stdscr.refresh()
-        # loop
+        fits = layout()
+        stdscr.keypad(True)
+        # loop: draw a frame when one is due, otherwise wait for keys until it is
         while True:
-            # generate top line
-            w = width-2
-            line = "".join(rng.choice("01ABCDEFGHIJKLMNOPQRSTUVWXYZ@#$%&*") if rng.random()>0.4 else " " for _ in range(w))
-            top_lines.pop(0); top_lines.append(line)
-            # draw
-            win_top.erase(); win_top.box()
-            try:
-                win_top.addstr(0,2, " Kamix Hollywood (cinematic) ", curses.color_pair(2) | curses.A_BOLD)
-            except curses.error:
-                pass
-            for idx, L in enumerate(top_lines):
+            if fits and clock.due():
+                t0 = time.perf_counter()
+                # take in what the jobs printed since the last frame
+                while True:
+                    try:
+                        jid, lines = job_out.get_nowait()
+                    except queue.Empty:
+                        break
+                    mid_dirty = True
+                    if lines is not None:
+                        lines = lines[-scrollback:]
+                    else:
+                        job = jobs.pop(jid, None)
+                        if not job:
+                            continue
+                        lines = ["Cancelled." if job.cancelled else f"Exited with code {job.proc.returncode}."]
+                    mid_lines.extend(f"[{jid}] {L}" for L in lines)
+                    if scroll:
+                        scroll += len(lines)  # keep a scrolled-back view where it is
+                # rain: scroll one row and write the new one, a rotated line from the pool
+                off = rng.randrange(width)
+                line = pool[rng.randrange(len(pool))]
+                line = line[off:] + line[:off]
+                top_lines.append(line)
+                win_top.scroll(1)
                 try:
-                    win_top.addstr(1+idx, 1, L[:width-2], curses.color_pair(1))
+                    win_top.insstr(top_h-2, 0, line, curses.color_pair(1))
                 except curses.error:
                     pass
-            win_top.refresh()
-            # mid
-            win_mid.erase(); win_mid.box()
-            try: win_mid.addstr(0,2," System / Output ", curses.color_pair(3))
-            except: pass
-            visible = mid_lines[-(mid_h-2):] if mid_lines else []
-            for i,L in enumerate(visible):
-                try: win_mid.addstr(1+i,1, L[:width-2], curses.color_pair(4))
-                except: pass
-            win_mid.refresh()
-            # bottom
-            win_bot.erase(); win_bot.box()
-            try:
-                display = prompt + input_buf
-                if len(display) > width-4: display = display[-(width-4):]
-                win_bot.addstr(1,1, display, curses.color_pair(3))
-                win_bot.move(1, 1 + len(display))
-            except:
-                pass
-            win_bot.refresh()
+                win_top.noutrefresh()
+                # header, with the render time once a second
+                if head_label is None or clock.frames % clock.fps == 0:
+                    label = clock.label()
+                    if label != head_label:
+                        head_label = label
+                        win_head.erase()
+                        try:
+                            win_head.addstr(0, 2, " Kamix Hollywood (cinematic) ", curses.color_pair(2) | curses.A_BOLD)
+                            win_head.insstr(0, max(0, width-len(label)-2), label, curses.color_pair(3))
+                        except curses.error:
+                            pass
+                        win_head.noutrefresh()
+                # mid, only when its text or scroll position changed
+                if mid_dirty:
+                    mid_dirty = False
+                    rows = mid_h-2
+                    scroll = max(0, min(scroll, len(mid_lines) - rows))
+                    win_mid.erase(); win_mid.box()
+                    title = f" System / Output - {len(jobs)} running " if jobs else " System / Output "
+                    if scroll:
+                        title += f"[{scroll} lines back] "
+                    try: win_mid.addstr(0,2,title, curses.color_pair(3))
+                    except: pass
+                    # deque indexing is cheap near the ends, which is where the view usually is
+                    first = max(0, len(mid_lines) - scroll - rows)
+                    for i in range(min(rows, len(mid_lines) - scroll)):
+                        try: win_mid.addstr(1+i,1, mid_lines[first+i][:width-2], curses.color_pair(4))
+                        except: pass
+                    win_mid.noutrefresh()
+                if bot_dirty:
+                    bot_dirty = False
+                    draw_bot()
+                win_bot.noutrefresh()  # last, so the cursor ends up at the prompt
+                curses.doupdate()  # one write per frame, only of cells that changed
+                clock.done(time.perf_counter() - t0)
+            elif fits and bot_dirty:  # echo typing without waiting for the next frame
+                bot_dirty = False
+                draw_bot()
+                win_bot.noutrefresh(); curses.doupdate()
             # input
-            ch = stdscr.getch()
+            keys = win_bot if fits else stdscr
+            keys.timeout(clock.wait_ms() if fits else 250)
+            ch = keys.getch()
             if ch == -1:
-                pass
-            elif ch in (10,13):
+                continue
+            if ch == curses.KEY_RESIZE:
+                fits = layout()
+                mid_dirty = bot_dirty = True
+                continue
+            if ch in (curses.KEY_PPAGE, curses.KEY_NPAGE):
+                page = max(1, mid_h-3)
+                scroll = max(0, scroll + (page if ch == curses.KEY_PPAGE else -page))
+                mid_dirty = True
+                continue
+            bot_dirty = True
+            if ch in (10,13,curses.KEY_ENTER):
                 cmd = input_buf.strip(); input_buf = ""
+                mid_dirty = True; scroll = 0
                 if cmd.lower() in ("exit","quit"):
                     break
-                if cmd:
-                    # run command and collect output lines (blocking)
+                if cmd == "jobs":
+                    mid_lines.extend([f"[{j.jid}] {j.cmd}" for j in jobs.values()] or ["No jobs running."])
+                elif cmd.split()[:1] == ["kill"] and cmd.split()[1:2] and cmd.split()[1].isdigit():
+                    job = jobs.get(int(cmd.split()[1]))
+                    if job: job.cancel()
+                    else: mid_lines.append(f"No job {cmd.split()[1]}.")
+                elif cmd:
                     try:
-                        p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-                        for L in p.stdout:
-                            mid_lines.append(L.rstrip("\n"))
-                            if len(mid_lines)>400: mid_lines.pop(0)
-                        p.wait()
-                        mid_lines.append(f"[Process exited with code {p.returncode}]")
+                        jobs[next_jid] = KamixJob(next_jid, cmd, job_out)
+                        mid_lines.append(f"[{next_jid}] {cmd}")
+                        next_jid += 1
                     except Exception as e:
                         mid_lines.append(f"[Error] {e}")
-            elif ch in (127,8):
+            elif ch == 24:  # Ctrl-X: stop the newest job
+                if jobs:
+                    jobs[max(jobs)].cancel()
+            elif ch in (127,8,curses.KEY_BACKSPACE):
                 input_buf = input_buf[:-1]
             elif 0 <= ch < 256:
                 input_buf += chr(ch)
-            time.sleep(0.02)
+        for job in jobs.values():
+            job.cancel()
+        return clock.summary()
     try:
         import curses
-        curses.wrapper(kamix_main)
+        print(curses.wrapper(kamix_main))
     except Exception as e:
         print("Curses UI error:", e)
     press_enter()
 
-# ---------------- Termux Secure Chat (embedded) ----------------
-def termux_chat_menu():
-    print("\nLaunching Termux Secure Chat v2 (menued).")
-    print("This will run a lightweight menu for Host/Client/Group.")
-    press_enter()
-    # embed the menu and functions (adapted from provided script)
-    def derive_key(pin: str, salt: bytes, iterations: int = 100_000, dklen: int = 32) -> bytes:
-        return hashlib.pbkdf2_hmac('sha256', pin.encode('utf-8'), salt, iterations, dklen)
-    def xor_bytes(data: bytes, key: bytes) -> bytes:
-        return bytes([b ^ key[i % len(key)] for i, b in enumerate(data)])
-    def send_json_line(sock: socket.socket, obj: dict):
+# ---------------- Termux Secure Chat: shared pieces ----------------
+def derive_key(pin: str, salt: bytes, iterations: int = 100_000, dklen: int = 32) -> bytes:
+    return hashlib.pbkdf2_hmac('sha256', pin.encode('utf-8'), salt, iterations, dklen)
+
+def xor_bytes(data: bytes, key: bytes) -> bytes:
+    # one big-int XOR against the repeated key instead of a Python loop per byte
+    n = len(data)
+    if not n:
+        return b""
+    stream = (key * (n // len(key) + 1))[:n]
+    return (int.from_bytes(data, 'little') ^ int.from_bytes(stream, 'little')).to_bytes(n, 'little')
+
+CHAT_V_XOR = 1      # legacy repeating-key XOR, for peers that predate negotiation
+CHAT_V_AESGCM = 2   # AES-256-GCM
+CHAT_VERSIONS = [CHAT_V_XOR, CHAT_V_AESGCM] if CRYPTO_OK else [CHAT_V_XOR]
+
+def chat_version(offered):
+    """Highest protocol version both sides support; a peer that offers none is legacy."""
+    common = set(CHAT_VERSIONS).intersection(offered or [CHAT_V_XOR])
+    return max(common) if common else None
+
+class ChatCipher:
+    """Message encryption for one negotiated protocol version. Version 2 is AES-256-GCM
+    under a subkey of the PBKDF2 key (so legacy XOR traffic never exposes it), with a
+    random 96-bit nonce in front of each ciphertext. Version 1 is the legacy XOR."""
+    def __init__(self, key, version):
+        self.key = key
+        self.version = version
+        if version == CHAT_V_AESGCM:
+            self.aead = AESGCM(hmac.new(key, b"kami-chat aes-gcm v2", hashlib.sha256).digest())
+    def encrypt(self, data: bytes, aad: bytes = None) -> bytes:
+        """`aad` (version 2 only) binds the ciphertext to context such as a file chunk index."""
+        if self.version == CHAT_V_XOR:
+            return xor_bytes(data, self.key)
+        nonce = token_bytes(12)
+        return nonce + self.aead.encrypt(nonce, data, aad)
+    def decrypt(self, data: bytes, aad: bytes = None) -> bytes:
+        """Raises ValueError when a version 2 message fails authentication."""
+        if self.version == CHAT_V_XOR:
+            return xor_bytes(data, self.key)
+        try:
+            return self.aead.decrypt(data[:12], data[12:], aad)
+        except InvalidTag:
+            raise ValueError("message failed authentication (wrong PIN or tampered)")
+
+def send_json_line(sock: socket.socket, obj: dict):
+    try:
+        data = json.dumps(obj, ensure_ascii=False).encode('utf-8') + b'\n'
+        sock.sendall(data)
+    except Exception:
+        pass
+
+FRAME_HEADER = struct.Struct(">IB")  # payload length, frame type
+FRAME_MSG = 1      # payload: name length (1 byte), UTF-8 name, raw ciphertext
+FRAME_CLOSE = 2    # sender is leaving (close / leave / server_close in JSON)
+FRAME_CTRL = 3     # payload: a JSON control message (file offers, acks, ...)
+FRAME_CHUNK = 4    # payload: 16-byte file id, >Q chunk index, ciphertext
+FRAME_MAX = 16 << 20
+CHAT_FRAMINGS = ["json", "binary"]
+
+def pack_frame(ftype, payload=b""):
+    return FRAME_HEADER.pack(len(payload), ftype) + payload
+
+def pack_msg_frame(name, ct):
+    n = (name or "").encode('utf-8')[:255]
+    return b"".join((FRAME_HEADER.pack(1 + len(n) + len(ct), FRAME_MSG), bytes((len(n),)), n, ct))
+
+def unpack_msg_frame(payload):
+    """(name, ciphertext) from a FRAME_MSG payload (bytes or memoryview)."""
+    n = payload[0]
+    return bytes(payload[1:1 + n]).decode('utf-8', errors='ignore'), bytes(payload[1 + n:])
+
+def encode_msg(name, ct, binary):
+    if binary:
+        return pack_msg_frame(name, ct)
+    return json.dumps({"type":"msg","name":name,"ct": base64.b64encode(ct).decode()}, ensure_ascii=False).encode('utf-8') + b'\n'
+
+def encode_ctrl(obj, binary):
+    data = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+    return pack_frame(FRAME_CTRL, data) if binary else data + b'\n'
+
+def encode_chunk(fid, seq, ct, binary):
+    """A file chunk; `fid` is the 32-digit hex file id."""
+    if binary:
+        return b"".join((FRAME_HEADER.pack(24 + len(ct), FRAME_CHUNK), bytes.fromhex(fid), struct.pack(">Q", seq), ct))
+    return encode_ctrl({"type":"file_chunk","id":fid,"seq":seq,"ct": base64.b64encode(ct).decode()}, False)
+
+def decode_frame(ftype, payload):
+    """A binary frame as the dict its JSON-line form decodes to (see decode_line)."""
+    if ftype == FRAME_MSG:
+        name, ct = unpack_msg_frame(payload)
+        return {"type":"msg","name":name,"ct":ct}
+    if ftype == FRAME_CHUNK and len(payload) >= 24:
+        return {"type":"file_chunk","id": bytes(payload[:16]).hex(),"seq": struct.unpack_from(">Q", payload, 16)[0],
+                "ct": bytes(payload[24:])}
+    if ftype == FRAME_CLOSE:
+        return {"type":"close"}
+    if ftype == FRAME_CTRL:
+        return decode_line(payload)
+    return {}
+
+def decode_line(raw):
+    """A JSON message as a dict ({} if unreadable). "ct" of a msg or file_chunk comes
+    back as raw bytes, or None if it is not valid base64."""
+    try:
+        obj = json.loads(bytes(raw).decode('utf-8', errors='ignore'))
+    except:
+        return {}
+    if not isinstance(obj, dict):
+        return {}
+    if obj.get("type") in ("msg","file_chunk"):
         try:
-            data = json.dumps(obj, ensure_ascii=False).encode('utf-8') + b'\n'
-            sock.sendall(data)
+            obj["ct"] = base64.b64decode(obj.get("ct"))
+        except:
+            obj["ct"] = None
+    return obj
+
+class FrameReader:
+    """Receive buffer for both framings. Socket data lands in one reusable bytearray
+    through recv_into() (or feed() under asyncio); binary frames come back as memoryview
+    slices of it, valid until the next read, and consumed bytes are compacted once per
+    read instead of re-slicing the buffer for every line."""
+    def __init__(self, size=1 << 16):
+        self.buf = bytearray(size)
+        self.start = self.end = 0
+        self.scan = 0  # where the next newline search resumes
+    def _reserve(self, need):
+        if self.start:
+            n = self.end - self.start
+            self.buf[:n] = self.buf[self.start:self.end]
+            self.scan -= self.start
+            self.start, self.end = 0, n
+        if len(self.buf) - self.end < need:
+            grown = bytearray(max(2 * len(self.buf), self.end + need))
+            grown[:self.end] = self.buf[:self.end]
+            self.buf = grown  # views handed out earlier keep the old buffer alive
+    def feed(self, data):
+        self._reserve(len(data))
+        self.buf[self.end:self.end + len(data)] = data
+        self.end += len(data)
+    def recv_from(self, sock, size=1 << 16):
+        """One recv_into() straight into the buffer; returns the byte count (0 at EOF)."""
+        self._reserve(size)
+        with memoryview(self.buf) as view:
+            n = sock.recv_into(view[self.end:self.end + size])
+        self.end += n
+        return n
+    def line(self):
+        """Next complete line without its newline, or None."""
+        i = self.buf.find(b'\n', self.scan, self.end)
+        if i < 0:
+            self.scan = self.end
+            return None
+        line = bytes(self.buf[self.start:i])
+        self.start = self.scan = i + 1
+        return line
+    def frame(self):
+        """Next complete binary frame as (type, memoryview payload), or None."""
+        if self.end - self.start < FRAME_HEADER.size:
+            return None
+        length, ftype = FRAME_HEADER.unpack_from(self.buf, self.start)
+        if length > FRAME_MAX:
+            raise ValueError(f"frame of {length} bytes exceeds FRAME_MAX")
+        begin = self.start + FRAME_HEADER.size
+        if self.end - begin < length:
+            return None
+        self.start = self.scan = begin + length
+        return ftype, memoryview(self.buf)[begin:self.start]
+    def read_line(self, sock):
+        """Block for the next line; a trailing unterminated line is returned at EOF, then None."""
+        while True:
+            line = self.line()
+            if line is not None:
+                return line
+            try:
+                n = self.recv_from(sock)
+            except OSError:
+                n = 0
+            if not n:
+                if self.end > self.start:
+                    line = bytes(self.buf[self.start:self.end])
+                    self.start = self.scan = self.end
+                    return line
+                return None
+    def read_frame(self, sock):
+        """Block for the next binary frame; None at EOF."""
+        while True:
+            item = self.frame()
+            if item is not None:
+                return item
+            try:
+                n = self.recv_from(sock)
+            except OSError:
+                n = 0
+            if not n:
+                return None
+
+def recv_lines(sock: socket.socket):
+    reader = FrameReader()
+    while True:
+        line = reader.read_line(sock)
+        if line is None:
+            break
+        yield line
+
+class ChatConn:
+    """Blocking end of a chat connection: JSON lines until a side switches to binary
+    frames. Sends take a lock (the receive and input threads both write), and the
+    framing is chosen under it so nothing can slip in after a switch."""
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = FrameReader()
+        self.binary_in = self.binary_out = False
+        self.lock = threading.Lock()
+    def _send(self, build):
+        try:
+            with self.lock:
+                self.sock.sendall(build())
         except Exception:
             pass
-    def recv_lines(sock: socket.socket):
-        buffer = b''
-        while True:
+    def send_json(self, obj):
+        self._send(lambda: json.dumps(obj, ensure_ascii=False).encode('utf-8') + b'\n')
+    def start_binary_out(self, ack=None):
+        """Send the JSON line `ack` if given, then frame everything after it as binary."""
+        with self.lock:
+            if ack:
+                self.sock.sendall(json.dumps(ack).encode('utf-8') + b'\n')
+            self.binary_out = True
+    def send_msg(self, name, ct):
+        self._send(lambda: encode_msg(name, ct, self.binary_out))
+    def send_ctrl(self, obj):
+        self._send(lambda: encode_ctrl(obj, self.binary_out))
+    def send_chunk(self, fid, seq, ct):
+        self._send(lambda: encode_chunk(fid, seq, ct, self.binary_out))
+    def send_close(self, json_type="close"):
+        self._send(lambda: pack_frame(FRAME_CLOSE) if self.binary_out else json.dumps({"type": json_type}).encode('utf-8') + b'\n')
+    def recv(self):
+        """Next message as a dict (see decode_line), or None once the connection ends.
+        FRAME_CLOSE reads as "close"."""
+        if self.binary_in:
+            try:
+                item = self.reader.read_frame(self.sock)
+            except ValueError:
+                return None
+            return None if item is None else decode_frame(*item)
+        raw = self.reader.read_line(self.sock)
+        return None if raw is None else decode_line(raw)
+    def close(self):
+        try: self.sock.close()
+        except: pass
+
+CHAT_FILE_CHUNK = 256 << 10  # plaintext bytes per encrypted file chunk
+CHAT_FILE_WINDOW = 8         # chunks a sender may have unacknowledged
+CHAT_FILE_TIMEOUT = 120      # seconds without an answer before a transfer gives up
+CHAT_FILE_DIR = "chat_files"
+CHAT_FILE_MAX = 4 << 30      # largest file offer put to the user; bigger ones are refused outright
+
+def chat_file_id(name, size, digest):
+    """Stable 32-hex-digit id, so sending the same file again resumes the transfer."""
+    return hashlib.sha256(f"{name}\0{size}\0{digest}".encode('utf-8')).hexdigest()[:32]
+
+def chunk_aad(fid, seq):
+    return bytes.fromhex(fid) + struct.pack(">Q", seq)
+
+class TransferProgress:
+    """Throttled one-line progress and throughput for a file transfer."""
+    def __init__(self, label, total, done=0):
+        self.label, self.total, self.base = label, total, done
+        self.t0 = time.monotonic()
+        self.last = 0.0
+    def rate(self, done):
+        return (done - self.base) / max(time.monotonic() - self.t0, 1e-6)
+    def show(self, done, final=False):
+        now = time.monotonic()
+        if not final and now - self.last < 0.5:
+            return
+        self.last = now
+        pct = done * 100 / self.total if self.total else 100.0
+        print(f"\r  {self.label}: {pct:5.1f}% of {self.total / 1048576:.1f}MiB at {self.rate(done) / 1048576:.2f}MiB/s   ",
+              end="\n" if final else "", flush=True)
+
+class FileReceiver:
+    """One incoming file, written in order to <outdir>/<name>.<id>.part and acknowledged
+    chunk by chunk. An existing .part file resumes at its last whole chunk; the file is
+    renamed into place once its SHA-256 matches the offer."""
+    def __init__(self, conn, offer, outdir=CHAT_FILE_DIR):
+        self.conn = conn
+        self.fid = str(offer["id"])
+        bytes.fromhex(self.fid)  # ValueError for a malformed id
+        self.size, self.chunk = int(offer["size"]), int(offer["chunk"])
+        if self.size < 0 or not 0 < self.chunk <= FRAME_MAX // 2:
+            raise ValueError("bad size or chunk length")
+        self.digest = offer.get("sha256")
+        name = os.path.basename(str(offer.get("name") or "")).strip()
+        self.name = name if name not in ("", ".", "..") else "file"
+        self.total = -(-self.size // self.chunk)
+        self.outdir = Path(outdir)
+        self.outdir.mkdir(parents=True, exist_ok=True)
+        self.part = self.outdir / f"{self.name}.{self.fid[:12]}.part"
+        have = self.part.stat().st_size if self.part.exists() else 0
+        self.next = min(have // self.chunk, self.total)
+        self.f = open(self.part, "a+b")
+        self.f.truncate(self.next * self.chunk)
+        self.f.seek(0)
+        self.hash = hashlib.sha256()
+        for block in iter(lambda: self.f.read(1 << 20), b""):
+            self.hash.update(block)
+        self.done = False
+        self.progress = TransferProgress(f"receiving {self.name}", self.size, self.next * self.chunk)
+        resume = f", resuming at {self.next * self.chunk / 1048576:.1f}MiB" if self.next else ""
+        print(f"\n[*] Receiving {self.name} ({self.size / 1048576:.1f}MiB) from {offer.get('from') or 'peer'}{resume}")
+        conn.send_ctrl({"type":"file_accept","id":self.fid,"next":self.next})
+        if self.next >= self.total:
+            self._finish()
+    def on_chunk(self, seq, ct, cipher):
+        """Write chunk `seq` if it is the next one; raises ValueError if it fails to decrypt."""
+        if self.done:
+            return
+        if seq > self.next:
+            print(f"\n[!] {self.name}: missed chunks from {self.next}, stopped (kept {self.part} for a resend)")
+            self.close()
+            return
+        if seq == self.next:
+            data = cipher.decrypt(ct, chunk_aad(self.fid, seq))
+            self.f.write(data)
+            self.hash.update(data)
+            self.next += 1
+            self.progress.show(min(self.next * self.chunk, self.size))
+        self.conn.send_ctrl({"type":"file_ack","id":self.fid,"next":self.next})
+        if self.next >= self.total:
+            self._finish()
+    def _finish(self):
+        self.close()
+        ok = not self.digest or self.hash.hexdigest() == self.digest
+        self.progress.show(self.size, final=True)
+        if ok:
+            stem, ext = os.path.splitext(self.name)
+            final, n = self.outdir / self.name, 1
+            while final.exists():
+                final, n = self.outdir / f"{stem} ({n}){ext}", n + 1
+            os.replace(self.part, final)
+            print(f"[+] Saved {final}")
+        else:
+            os.remove(self.part)  # resuming a corrupt prefix would only fail again
+            print(f"[!] {self.name}: checksum mismatch, discarded")
+        self.conn.send_ctrl({"type":"file_done","id":self.fid,"ok":ok})
+    def close(self):
+        self.done = True
+        if not self.f.closed:
+            self.f.close()
+
+class FileSender:
+    """One outgoing file: offered with its SHA-256, then streamed from whatever chunk
+    the peer asks for, with at most `window` chunks unacknowledged. A later file_accept
+    for an earlier chunk (a group member further behind accepting) rewinds to it. Only
+    one chunk is read at a time, so memory stays flat for any file size."""
+    def __init__(self, conn, path, window=CHAT_FILE_WINDOW, chunk=CHAT_FILE_CHUNK):
+        self.conn, self.path, self.window, self.chunk = conn, path, window, chunk
+        self.name = os.path.basename(path)
+        self.size = os.path.getsize(path)
+        self.total = -(-self.size // chunk)
+        self.fid = None
+        self.acked = None  # next chunk the peer needs; None until it accepts
+        self.rewind = None  # chunk to go back to, from a late file_accept
+        self.verified = None
+        self.cancelled = False
+        self.cond = threading.Condition()
+    def on_ctrl(self, obj):
+        with self.cond:
+            t = obj.get("type")
+            if t == "file_accept" and self.acked is not None:
+                self.rewind = int(obj.get("next") or 0)
+                self.acked = min(self.acked, self.rewind)
+            elif t in ("file_accept","file_ack"):
+                self.acked = int(obj.get("next") or 0)
+            elif t == "file_done":
+                self.verified = bool(obj.get("ok"))
+            elif t == "file_cancel":
+                self.cancelled = True
+            self.cond.notify_all()
+    def cancel(self):
+        with self.cond:
+            self.cancelled = True
+            self.cond.notify_all()
+    def _wait(self, ready, timeout=CHAT_FILE_TIMEOUT):
+        with self.cond:
+            return self.cond.wait_for(lambda: self.cancelled or ready(), timeout) and not self.cancelled
+    def run(self, cipher_fn, sender_name, register):
+        print(f"\n[*] Hashing {self.name}...")
+        digest = _sha256_file(self.path)
+        self.fid = chat_file_id(self.name, self.size, digest)
+        register(self)
+        self.conn.send_ctrl({"type":"file_offer","id":self.fid,"name":self.name,"size":self.size,
+                             "chunk":self.chunk,"sha256":digest,"from":sender_name})
+        if not self._wait(lambda: self.acked is not None):
+            print(f"\n[!] {self.name}: {'refused' if self.cancelled else 'no answer from peer'}."); return False
+        seq = self.acked
+        progress = TransferProgress(f"sending {self.name}", self.size, seq * self.chunk)
+        with open(self.path, "rb") as f:
+            f.seek(seq * self.chunk)
+            while True:
+                if seq >= self.total:
+                    if not self._wait(lambda: self.rewind is not None or self.acked >= self.total):
+                        print(f"\n[!] {self.name}: peer stopped acknowledging."); return False
+                elif not self._wait(lambda: self.rewind is not None or seq - self.acked < self.window):
+                    print(f"\n[!] {self.name}: transfer stalled or cancelled at {seq * self.chunk / 1048576:.1f}MiB."); return False
+                with self.cond:
+                    if self.rewind is not None:
+                        seq, self.rewind = self.rewind, None
+                        f.seek(seq * self.chunk)
+                        continue
+                if seq >= self.total:
+                    break
+                data = f.read(self.chunk)
+                self.conn.send_chunk(self.fid, seq, cipher_fn().encrypt(data, chunk_aad(self.fid, seq)))
+                seq += 1
+                progress.show(min(self.acked * self.chunk, self.size))
+        progress.show(self.size, final=True)
+        # a 1:1 peer confirms the checksum; a group server only relays, so don't wait long
+        self._wait(lambda: self.verified is not None, 2)
+        note = {True: ", checksum verified by peer", False: ", peer reports checksum MISMATCH"}.get(self.verified, "")
+        print(f"[+] Sent {self.name}{note}")
+        return True
+
+class FileTransfers:
+    """File sends and receives in flight on one ChatConn, keyed by file id. The receive
+    loop passes every message to handle(), the input loop every line to command();
+    send() streams from its own thread. Offers wait for /accept or /reject, and ones
+    over `max_size` or the free space in `outdir` are refused without asking."""
+    def __init__(self, conn, cipher_fn, name, outdir=CHAT_FILE_DIR, max_size=CHAT_FILE_MAX):
+        self.conn, self.cipher_fn, self.name, self.outdir = conn, cipher_fn, name, outdir
+        self.max_size = max_size
+        self.senders = {}
+        self.receivers = {}
+        self.offers = collections.OrderedDict()  # file id -> (offer, time received), oldest first
+        self.lock = threading.Lock()  # command() runs on the input thread, handle() on the receive one
+    def command(self, line):
+        """Run a /send, /accept or /reject line; returns False for anything else."""
+        cmd, _, arg = line.strip().partition(" ")
+        if cmd == "/send" and arg.strip():
+            self.send(arg.strip().strip('"'))
+        elif cmd in ("/accept","/reject"):
+            with self.lock:
+                self._answer(cmd == "/accept")
+        else:
+            return False
+        return True
+    def _answer(self, accept):
+        """Accept or refuse the oldest waiting offer."""
+        if not self.offers:
+            print("No file offer waiting."); return
+        fid, (offer, received) = self.offers.popitem(last=False)
+        if not accept:
+            self.conn.send_ctrl({"type":"file_cancel","id":fid})
+            print(f"[*] Refused {offer.get('name')}.")
+        elif time.monotonic() - received > CHAT_FILE_TIMEOUT:
+            print(f"[!] The offer of {offer.get('name')} has expired; ask for it again.")
+        else:
+            self._receive(offer)
+    def _check(self, offer):
+        """Raises ValueError for an offer too big for the cap or the disk."""
+        size = int(offer["size"])
+        if self.max_size and size > self.max_size:
+            raise ValueError(f"{size / 1048576:.1f}MiB is over the {self.max_size / 1048576:.0f}MiB limit")
+        where = Path(self.outdir).resolve()
+        while not where.exists():
+            where = where.parent
+        if disk_usage(where).free < size:
+            raise ValueError(f"not enough free space for {size / 1048576:.1f}MiB")
+    def _receive(self, offer):
+        fid = offer.get("id")
+        try:
+            self._check(offer)
+            receiver = FileReceiver(self.conn, offer, self.outdir)
+        except (KeyError, TypeError, ValueError, OSError) as e:
+            print(f"\n[!] Refused file offer: {e}")
+            self.conn.send_ctrl({"type":"file_cancel","id":fid})
+            return
+        if not receiver.done:
+            self.receivers[fid] = receiver
+    def send(self, path):
+        if not os.path.isfile(path):
+            print("File not found."); return
+        sender = FileSender(self.conn, path)
+        threading.Thread(target=self._send, args=(sender,), daemon=True).start()
+    def _send(self, sender):
+        try:
+            sender.run(self.cipher_fn, self.name, lambda s: self.senders.__setitem__(s.fid, s))
+        except OSError as e:
+            print(f"\n[!] {sender.name}: {e}")
+        finally:
+            self.senders.pop(sender.fid, None)
+    def handle(self, obj):
+        """Consume a file message; returns False for anything else."""
+        t = obj.get("type") or ""
+        if not t.startswith("file_"):
+            return False
+        with self.lock:
+            self._handle(t, obj.get("id"), obj)
+        return True
+    def _handle(self, t, fid, obj):
+        if t == "file_offer":
+            old = self.receivers.pop(fid, None)
+            if old:
+                old.close()
             try:
-                chunk = sock.recv(4096)
-            except Exception:
+                self._check(obj)
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"\n[!] Refused file offer of {obj.get('name')}: {e}")
+                self.conn.send_ctrl({"type":"file_cancel","id":fid})
+                return
+            self.offers.pop(fid, None)
+            self.offers[fid] = (obj, time.monotonic())
+            print(f"\n[?] {obj.get('from') or 'Peer'} wants to send {obj.get('name')} ({int(obj['size']) / 1048576:.1f}MiB). "
+                  "/accept to receive it, /reject to refuse.")
+        elif t == "file_chunk":
+            receiver = self.receivers.get(fid)
+            if receiver:
+                try:
+                    receiver.on_chunk(int(obj.get("seq")), obj.get("ct"), self.cipher_fn())
+                except (TypeError, ValueError):
+                    print(f"\n[!] {receiver.name}: corrupt chunk, transfer stopped.")
+                    receiver.close()
+                if receiver.done:
+                    self.receivers.pop(fid, None)
+        elif fid in self.senders:
+            self.senders[fid].on_ctrl(obj)
+        elif t == "file_cancel":
+            offer = self.offers.pop(fid, None)
+            receiver = self.receivers.pop(fid, None)
+            if offer:
+                print(f"\n[*] The offer of {offer[0].get('name')} was withdrawn.")
+            elif receiver:
+                receiver.close()
+                print(f"\n[!] {receiver.name}: sender stopped, kept {receiver.part} for a resend.")
+    def close(self):
+        for sender in list(self.senders.values()):
+            sender.cancel()
+        for receiver in list(self.receivers.values()):
+            receiver.close()
+
+CHAT_QUEUE_FRAMES = 256     # frames buffered per group client before it is dropped as too slow
+CHAT_LINE_LIMIT = 1 << 20   # longest JSON line a group client may send
+CHAT_FILE_RELAYS = 64       # unfinished group file transfers remembered for resume
+
+CHAT_HISTORY_FILE = os.path.join("chat_history", "group.log")
+CHAT_HISTORY_JOIN = 20      # messages a group client asks for when it joins
+CHAT_HISTORY_MAX = 1000     # most messages one history request returns
+CHAT_HISTORY_BATCH = 256 << 10  # plaintext bytes per history reply frame
+CHAT_HISTORY_REPLY = 8 << 20    # plaintext bytes one history request is answered with at most
+HISTORY_MAGIC = b"KAMIHIST2"
+HISTORY_HEADER = len(HISTORY_MAGIC) + 16 + 32  # magic, PBKDF2 salt, PIN check
+HISTORY_RECORD = struct.Struct(">dI")   # timestamp, ciphertext bytes; then nonce + AES-GCM of sender and text
+HISTORY_INDEX = struct.Struct(">QdIq")  # record offset, timestamp, sender tag, same sender's previous entry (-1: none)
+HISTORY_HEADS = struct.Struct(">Iq")    # .sidx entry: sender tag, that sender's newest entry
+
+def _private_file(path):
+    """`path` opened for appending and reading, created 0600 (and made 0600 if it exists)."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0), 0o600)
+    try:
+        os.fchmod(fd, 0o600)
+    except (AttributeError, OSError):
+        pass  # no fchmod on Windows
+    return os.fdopen(fd, "a+b", buffering=0)
+
+class MessageLog:
+    """Append-only, encrypted group history, one log per group: the header holds a salt
+    and a check of the key the group PIN derives with it, and a log opened with another
+    PIN is refused. Records are AES-GCM under that key, bound to their offset and time.
+
+    `path` holds the records, `path`.idx one fixed-size HISTORY_INDEX entry per record in
+    time order, so the last N messages are a slice of the index and a time range is a
+    binary search on it. Each entry also links to the same sender's previous entry, and
+    `path`.sidx keeps every sender's newest one, so a sender's messages are a walk down
+    their own chain, not a scan of everyone's. Senders are keyed by a keyed hash, never
+    by name. Both files are read through mmaps: memory use does not grow with the log,
+    and a query touches only the index pages it searches and the records it returns.
+
+    Records are written before their index entry; on open, an unindexed or torn tail
+    left by a crash is cut off. Files are created 0600."""
+    def __init__(self, path, pin):
+        if not CRYPTO_OK:
+            raise ValueError("message history needs the cryptography package")
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, mode=0o700, exist_ok=True)
+        self.path = path
+        self.data = _private_file(path)
+        self.idx = _private_file(path + ".idx")
+        self.maps = {}  # file -> read-only mmap, remapped when the file outgrows it
+        dsize = os.fstat(self.data.fileno()).st_size
+        if dsize < HISTORY_HEADER:
+            # a new log, or a header torn before any record was written
+            self.data.truncate(0); self.idx.truncate(0)
+            salt = token_bytes(16)
+            key = derive_key(pin, salt)
+            self.data.write(HISTORY_MAGIC + salt + hmac.new(key, b"kami-history-check", hashlib.sha256).digest())
+            dsize = HISTORY_HEADER
+        else:
+            self.data.seek(0)
+            head = self.data.read(HISTORY_HEADER)
+            if not head.startswith(HISTORY_MAGIC):
+                self.close(); raise ValueError(f"{path} is not a message history log")
+            key = derive_key(pin, head[len(HISTORY_MAGIC):len(HISTORY_MAGIC) + 16])
+            if not hmac.compare_digest(head[-32:], hmac.new(key, b"kami-history-check", hashlib.sha256).digest()):
+                self.close(); raise ValueError(f"{path} belongs to a group with a different PIN")
+        self.aead = AESGCM(hmac.new(key, b"kami-history-records", hashlib.sha256).digest())
+        self.tag_key = hmac.new(key, b"kami-history-senders", hashlib.sha256).digest()
+        isize = os.fstat(self.idx.fileno()).st_size
+        self.count, self.end, self.last_ts = isize // HISTORY_INDEX.size, HISTORY_HEADER, 0.0
+        while self.count:
+            off, ts, _, _ = self._entry(self.count - 1)
+            if off + HISTORY_RECORD.size <= dsize:
+                _, clen = HISTORY_RECORD.unpack_from(self._map(self.data, dsize), off)
+                if off + HISTORY_RECORD.size + clen <= dsize:
+                    self.end, self.last_ts = off + HISTORY_RECORD.size + clen, ts
+                    break
+            self.count -= 1
+        self._close_maps()
+        if isize != self.count * HISTORY_INDEX.size:
+            self.idx.truncate(self.count * HISTORY_INDEX.size)
+        if dsize != self.end:
+            self.data.truncate(self.end)
+        self.heads = self._load_heads()  # sender tag -> newest index entry
+    def __len__(self):
+        return self.count
+    def _map(self, f, size):
+        m = self.maps.get(f)
+        if m is None or len(m) < size:
+            if m is not None:
+                m.close()
+            m = self.maps[f] = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        return m
+    def _close_maps(self):
+        for m in self.maps.values():
+            m.close()
+        self.maps.clear()
+    def _entry(self, i):
+        return HISTORY_INDEX.unpack_from(self._map(self.idx, self.count * HISTORY_INDEX.size), i * HISTORY_INDEX.size)
+    def _tag(self, name):
+        return int.from_bytes(hmac.new(self.tag_key, name.encode('utf-8')[:0xFFFF], hashlib.sha256).digest()[:4], 'big')
+    def _load_heads(self):
+        """The .sidx saved by close(), brought up to date with entries added after it
+        (all of them if it is missing, e.g. after a crash)."""
+        heads, covered = {}, 0
+        try:
+            with open(self.path + ".sidx", "rb") as f:
+                raw = f.read()
+            covered = struct.unpack_from(">Q", raw)[0]
+            if covered > self.count or (len(raw) - 8) % HISTORY_HEADS.size:
+                raise ValueError
+            heads = dict(HISTORY_HEADS.iter_unpack(raw[8:]))
+        except (OSError, ValueError, struct.error):
+            heads, covered = {}, 0
+        for i in range(covered, self.count):
+            heads[self._entry(i)[2]] = i
+        return heads
+    def _record(self, i):
+        """Entry `i` as {"ts", "name", "text"}, or None if it does not decrypt."""
+        off, ts, _, _ = self._entry(i)
+        data = self._map(self.data, self.end)
+        _, clen = HISTORY_RECORD.unpack_from(data, off)
+        ct = data[off + HISTORY_RECORD.size:off + HISTORY_RECORD.size + clen]
+        try:
+            plain = self.aead.decrypt(ct[:12], ct[12:], struct.pack(">Qd", off, ts))
+        except InvalidTag:
+            return None
+        nlen = struct.unpack_from(">H", plain)[0]
+        return {"ts": ts, "name": plain[2:2 + nlen].decode('utf-8', errors='ignore'),
+                "text": plain[2 + nlen:].decode('utf-8', errors='ignore')}
+    def append(self, name, text, ts=None):
+        name, text = str(name), str(text)
+        # never step back in time, or the index would stop being sorted
+        ts = max(time.time() if ts is None else ts, self.last_ts)
+        nb = name.encode('utf-8')[:0xFFFF]
+        nonce = token_bytes(12)
+        ct = nonce + self.aead.encrypt(nonce, struct.pack(">H", len(nb)) + nb + text.encode('utf-8'),
+                                       struct.pack(">Qd", self.end, ts))
+        tag = self._tag(name)
+        self.data.write(HISTORY_RECORD.pack(ts, len(ct)) + ct)
+        self.idx.write(HISTORY_INDEX.pack(self.end, ts, tag, self.heads.get(tag, -1)))
+        self.heads[tag] = self.count
+        self.end += HISTORY_RECORD.size + len(ct)
+        self.count += 1
+        self.last_ts = ts
+    def _bisect(self, ts):
+        """First index whose timestamp is >= ts."""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[1] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+    def _sender_entries(self, sender, until):
+        """Index entries of `sender` (or a tag collision) newest first, from `until` back."""
+        i = self.heads.get(self._tag(sender), -1)
+        while i >= 0:
+            _, ts, _, prev = self._entry(i)
+            if until is None or ts <= until:
+                yield i, ts
+            i = prev
+    def query(self, last=None, since=None, until=None, sender=None, limit=CHAT_HISTORY_MAX):
+        """Messages as {"ts", "name", "text"} dicts, oldest first, and whether more matched.
+        Without since/until it is the `last` newest; otherwise the first `limit` from
+        `since` through `until`. `sender` keeps one sender's messages, found through
+        their chain of entries."""
+        limit = max(0, min(limit or CHAT_HISTORY_MAX, CHAT_HISTORY_MAX))
+        ranged = since is not None or until is not None
+        want = limit if ranged else min(limit, CHAT_HISTORY_JOIN if last is None else max(0, last))
+        if sender is not None:
+            sender = str(sender)
+            if ranged:
+                # newest first down the chain, stopping at `since`; keep the oldest `want`
+                found = []
+                for i, ts in self._sender_entries(sender, until):
+                    if since is not None and ts < since:
+                        break
+                    found.append(i)
+                found.reverse()
+            else:
+                found = (i for i, _ in self._sender_entries(sender, None))
+        elif ranged:
+            found = range(self._bisect(since or 0.0), self.count)
+        else:
+            found = range(self.count - 1, -1, -1)
+        out, more = [], False
+        for i in found:
+            if until is not None and sender is None and self._entry(i)[1] > until:
                 break
-            if not chunk:
-                if buffer:
-                    yield buffer
+            rec = self._record(i)
+            if rec is None or (sender is not None and rec["name"] != sender):
+                continue
+            if len(out) == want:
+                more = True; break
+            out.append(rec)
+        if not ranged:
+            out.reverse()
+        return out, more
+    def close(self):
+        self._close_maps()
+        if getattr(self, "heads", None) is not None and not self.data.closed:
+            part = self.path + ".sidx.part"
+            with _private_file(part) as f:
+                f.truncate(0)
+                f.write(struct.pack(">Q", self.count) + b"".join(HISTORY_HEADS.pack(t, i) for t, i in self.heads.items()))
+            os.replace(part, self.path + ".sidx")
+        self.data.close(); self.idx.close()
+
+class AsyncGroupServer:
+    """Group chat server on a single asyncio loop, speaking the protocol of
+    run_group_client(): salt -> join -> msg/leave, answered with msg/server_close. A join
+    asking for "binary" framing switches that client to FRAME_HEADER frames both ways;
+    clients that predate it stay on JSON lines.
+
+    With a `history` path (off by default) every message is appended to a MessageLog
+    there, encrypted under the group PIN; the salt message tells clients so, and a
+    {"type":"history"} request (last / since / until / sender / limit) is answered with
+    encrypted "history" control messages.
+
+    File offers and chunks are relayed to everyone else. The server is the sender's
+    acknowledging peer: it acks a chunk once every other client has room for it, and
+    remembers how far an unfinished transfer got so a re-send resumes there.
+
+    Every client gets an outbound queue drained by its own writer task, so a broadcast
+    only enqueues frames and a slow peer backs up nobody but itself. A peer whose queue
+    overflows CHAT_QUEUE_FRAMES is disconnected."""
+    def __init__(self, bind, port, pin, name, queue_frames=CHAT_QUEUE_FRAMES, quiet=False, history=None):
+        self.bind=bind; self.port=port; self.pin=pin; self.name=name
+        self.history_path = history
+        self.history = None  # MessageLog, opened in start()
+        self.queue_frames = queue_frames
+        self.log = (lambda *a: None) if quiet else print  # per-client events
+        self.salt = token_bytes(16)
+        self.key = None  # derived once in start(), shared by every client
+        self.ciphers = {}  # protocol version -> ChatCipher
+        self.clients = {}  # writer -> {"name", "addr", "queue", "v", "binary"}
+        self.conns = set()  # every open writer, joined or still handshaking
+        self.files = {}  # file id -> {"offer", "total", "next", "sender", "asked", "peers"}
+        self.tasks = set()  # running handle_client() tasks
+        self.server = None
+        self.closed = None
+    async def start(self):
+        self.closed = asyncio.Event()
+        # the only PBKDF2 run: all clients use the same PIN and salt, so joins skip it
+        self.key = await asyncio.get_running_loop().run_in_executor(None, derive_key, self.pin, self.salt)
+        self.ciphers = {v: ChatCipher(self.key, v) for v in CHAT_VERSIONS}
+        if self.history_path:
+            # PBKDF2 again, under the log's own salt
+            self.history = await asyncio.get_running_loop().run_in_executor(None, MessageLog, self.history_path, self.pin)
+        self.server = await asyncio.start_server(self.handle_client, self.bind, self.port,
+                                                 limit=CHAT_LINE_LIMIT, backlog=1024)
+        self.port = self.server.sockets[0].getsockname()[1]
+        print(f"Group server on {self.bind}:{self.port}")
+    @staticmethod
+    def frame(obj):
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8') + b'\n'
+    def _enqueue(self, writer, queue, frame):
+        try:
+            queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            info = self.clients.pop(writer, None)
+            if info:
+                self.log(f"[-] {info.get('name')} dropped (too slow).")
+            writer.transport.abort()
+    async def _drain(self, writer, queue):
+        """Writer task: send queued frames in batches until the None sentinel."""
+        try:
+            while True:
+                frame = await queue.get()
+                while frame is not None:
+                    if writer.is_closing():
+                        return  # peer went away; asyncio would only log each write
+                    writer.write(frame)
+                    if queue.empty():
+                        break
+                    frame = queue.get_nowait()
+                await writer.drain()
+                if frame is None:
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+    async def handle_client(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        queue = asyncio.Queue(self.queue_frames)
+        sender = asyncio.ensure_future(self._drain(writer, queue))
+        self.conns.add(writer)
+        self.tasks.add(asyncio.current_task())
+        info = None
+        try:
+            self._enqueue(writer, queue, self.frame({"type":"salt","salt": base64.b64encode(self.salt).decode(),
+                                                     "versions": CHAT_VERSIONS, "framing": CHAT_FRAMINGS,
+                                                     "history": self.history is not None}))
+            first = await reader.readline()
+            try:
+                obj = json.loads(first.decode('utf-8', errors='ignore'))
+            except:
+                return
+            if not isinstance(obj, dict) or obj.get("type")!="join":
+                return
+            cname = str(obj.get("name") or "Anon")
+            # joins without "v" come from clients that predate negotiation
+            version = chat_version([obj.get("v", CHAT_V_XOR)])
+            if version is None:
+                return
+            cipher = self.ciphers[version]
+            binary = obj.get("framing") == "binary"
+            info = {"name":cname,"addr":addr,"queue":queue,"v":version,"binary":binary}
+            self.clients[writer] = info
+            self.log(f"[+] {cname} joined from {addr}")
+            self.broadcast_system(f"{cname} joined the group.")
+            frames = FrameReader() if binary else None
+            while True:
+                if binary:
+                    item = frames.frame()
+                    if item is None:
+                        data = await reader.read(1 << 16)
+                        if not data:
+                            break
+                        frames.feed(data)
+                        continue
+                    m = decode_frame(*item)
+                else:
+                    raw = await reader.readline()
+                    if not raw:
+                        break
+                    m = decode_line(raw)
+                t = m.get("type")
+                if t in ("leave","close"):
+                    break
+                if t=="msg":
+                    try:
+                        pt = cipher.decrypt(m.get("ct")).decode('utf-8', errors='ignore')
+                    except:
+                        continue
+                    self.broadcast_plain(str(m.get("name") or cname), pt)
+                elif t == "history":
+                    self.send_history(writer, info, cipher, m)
+                elif t in ("file_offer","file_chunk"):
+                    await self.relay_file(writer, info, cipher, m)
+                elif t in ("file_accept","file_cancel","file_done"):
+                    self.file_reply(writer, m)
+        except (ConnectionError, OSError, ValueError):
+            pass  # reset, a line over CHAT_LINE_LIMIT or a frame over FRAME_MAX
+        finally:
+            self.conns.discard(writer)
+            self.tasks.discard(asyncio.current_task())
+            for fid, rec in list(self.files.items()):
+                if rec["sender"] is writer:
+                    self.files.pop(fid)
+                    for w in rec["asked"]:
+                        self._send_ctrl(w, {"type":"file_cancel","id":fid})
+                elif writer in rec["asked"]:
+                    self.file_reply(writer, {"type":"file_cancel","id":fid})
+            if self.clients.pop(writer, None):
+                self.broadcast_system(f"{info.get('name')} left the group.")
+                self.log(f"[-] {info.get('name')} disconnected.")
+            if not sender.done():
+                try:
+                    queue.put_nowait(None)
+                except asyncio.QueueFull:
+                    sender.cancel(); writer.transport.abort()
+    def _fan_out(self, data, encode, aad=None, skip=None, to=None):
+        """Encrypt `data` once per protocol version and serialize it once per (version,
+        framing) with encode(ct, binary), then enqueue that same bytes frame for every
+        client (or every client in `to`) but `skip`."""
+        cts, frames = {}, {}
+        targets = self.clients.items() if to is None else [(w, self.clients[w]) for w in to if w in self.clients]
+        for writer, info in list(targets):
+            if writer is skip:
+                continue
+            fkey = (info["v"], info["binary"])
+            frame = frames.get(fkey)
+            if frame is None:
+                ct = cts.get(info["v"])
+                if ct is None:
+                    ct = cts[info["v"]] = self.ciphers[info["v"]].encrypt(data, aad)
+                frame = frames[fkey] = encode(ct, info["binary"])
+            self._enqueue(writer, info["queue"], frame)
+    def broadcast_plain(self, sender_name, plaintext):
+        if self.history is not None:
+            self.history.append(sender_name or "Anon", plaintext)
+        self._fan_out(plaintext.encode('utf-8'), lambda ct, binary: encode_msg(sender_name, ct, binary))
+    def _send_ctrl(self, writer, obj):
+        info = self.clients.get(writer)
+        if info:
+            self._enqueue(writer, info["queue"], encode_ctrl(obj, info["binary"]))
+    async def relay_file(self, writer, info, cipher, m):
+        """Pass a file offer from `writer` to every other client, then its chunks to the
+        ones that accepted (see file_reply). The sender streams from the earliest chunk
+        any of them still needs, so members ahead just skip what they already have."""
+        fid = m.get("id")
+        if m.get("type") == "file_offer":
+            try:
+                bytes.fromhex(fid)
+                total = -(-int(m["size"]) // int(m["chunk"]))
+                if len(fid) != 32 or not 0 < int(m["chunk"]) <= CHAT_FILE_CHUNK:
+                    raise ValueError
+            except (KeyError, TypeError, ValueError):
+                return
+            self.files.pop(fid, None)
+            rec = self.files[fid] = {"offer": dict(m, **{"from": info["name"]}), "total": total, "sender": writer,
+                                     "next": None, "asked": {w for w in self.clients if w is not writer}, "peers": {}}
+            while len(self.files) > CHAT_FILE_RELAYS:
+                self.files.pop(next(iter(self.files)))
+            if not rec["asked"]:
+                self.files.pop(fid, None)
+                self._send_ctrl(writer, {"type":"file_cancel","id":fid})
+                return
+            ctrl = {b: encode_ctrl(rec["offer"], b) for b in (False, True)}
+            for w in rec["asked"]:
+                self._enqueue(w, self.clients[w]["queue"], ctrl[self.clients[w]["binary"]])
+            self.log(f"[*] {info['name']} is offering {m.get('name')} ({int(m['size']) / 1048576:.1f}MiB)")
+            return
+        rec = self.files.get(fid)
+        if not rec or rec["sender"] is not writer or rec["next"] is None or not isinstance(m.get("seq"), int):
+            return
+        if m["seq"] == rec["next"]:
+            aad = chunk_aad(fid, m["seq"])
+            try:
+                data = cipher.decrypt(m.get("ct"), aad)
+            except:
+                return
+            # flow control: hold the chunk (and the sender's ack) while a receiver is backed up
+            deadline = time.monotonic() + CHAT_FILE_TIMEOUT
+            while time.monotonic() < deadline and any(
+                    self.clients[w]["queue"].qsize() >= CHAT_FILE_WINDOW for w in list(rec["peers"]) if w in self.clients):
+                await asyncio.sleep(0.01)
+            if self.files.get(fid) is not rec or rec["next"] != m["seq"]:
+                return  # refused by everyone, or rewound for a late accept, while we waited
+            self._fan_out(data, lambda ct, binary: encode_chunk(fid, m["seq"], ct, binary), aad, to=rec["peers"])
+            rec["next"] += 1
+        if rec["next"] >= rec["total"]:
+            self.files.pop(fid, None)
+        self._send_ctrl(writer, {"type":"file_ack","id":fid,"next":rec["next"]})
+    def file_reply(self, writer, m):
+        """A receiver's answer to a relayed offer. An accept further behind than the relay
+        has got rewinds the sender to it; when every member has refused or finished, the
+        sender is told to stop."""
+        fid, t = m.get("id"), m.get("type")
+        rec = self.files.get(fid)
+        if not rec or writer not in rec["asked"]:
+            if t == "file_accept":
+                self._send_ctrl(writer, {"type":"file_cancel","id":fid})  # the transfer is over
+            return
+        if t == "file_accept":
+            try:
+                n = min(max(int(m.get("next") or 0), 0), rec["total"])
+            except (TypeError, ValueError):
+                return
+            if n >= rec["total"]:
+                return  # already complete; its file_done follows
+            rec["peers"][writer] = n
+            if rec["next"] is None or n < rec["next"]:
+                rec["next"] = n
+                self._send_ctrl(rec["sender"], {"type":"file_accept","id":fid,"next":n})
+            return
+        rec["asked"].discard(writer)
+        rec["peers"].pop(writer, None)
+        if not rec["asked"]:
+            self.files.pop(fid, None)
+            if t == "file_done" and rec["next"] is None:
+                # nobody needed a byte: everyone who accepted had the whole file already
+                self._send_ctrl(rec["sender"], {"type":"file_accept","id":fid,"next":rec["total"]})
+            else:
+                self._send_ctrl(rec["sender"], {"type":"file_cancel","id":fid})
+    def broadcast_system(self, text):
+        self._fan_out(text.encode('utf-8'), lambda ct, binary: encode_msg("System", ct, binary))
+    def send_history(self, writer, info, cipher, m):
+        """Answer a history request with "history" control messages whose "ct" is an
+        encrypted JSON list of {"ts", "name", "text"}; the last one has "done" set, and
+        "more" says the query matched more than was sent."""
+        items, more = [], False
+        if self.history is not None:
+            try:
+                items, more = self.history.query(
+                    last=None if m.get("last") is None else int(m["last"]),
+                    since=None if m.get("since") is None else float(m["since"]),
+                    until=None if m.get("until") is None else float(m["until"]),
+                    sender=None if m.get("sender") is None else str(m["sender"]),
+                    limit=int(m.get("limit") or CHAT_HISTORY_MAX))
+            except (TypeError, ValueError):
+                pass
+        # keep the reply bounded: drop the oldest of a "last N", the newest of a range
+        newest_first = m.get("since") is None and m.get("until") is None
+        budget = CHAT_HISTORY_REPLY
+        for n, it in enumerate(reversed(items) if newest_first else items):
+            budget -= len(it["name"]) + len(it["text"]) + 40
+            if budget < 0:
+                items = items[len(items) - n:] if newest_first else items[:n]
+                more = True
                 break
-            buffer += chunk
-            while b'\n' in buffer:
-                line, buffer = buffer.split(b'\n', 1)
-                yield line
+        batches, batch, size = [], [], 0
+        for it in items:
+            batch.append(it)
+            size += len(it["name"]) + len(it["text"]) + 40
+            if size >= CHAT_HISTORY_BATCH:
+                batches.append(batch); batch, size = [], 0
+        if batch or not batches:
+            batches.append(batch)
+        for n, batch in enumerate(batches, 1):
+            ct = cipher.encrypt(json.dumps(batch, ensure_ascii=False).encode('utf-8'), b"history")
+            self._enqueue(writer, info["queue"], encode_ctrl({"type":"history","ct": base64.b64encode(ct).decode(),
+                                                              "done": n == len(batches),"more": more}, info["binary"]))
+    async def stop(self):
+        if self.server is None:
+            return
+        self.server.close()
+        bye = {False: self.frame({"type":"server_close"}), True: pack_frame(FRAME_CLOSE)}
+        for writer, info in list(self.clients.items()):
+            self._enqueue(writer, info["queue"], bye[info["binary"]])
+            self._enqueue(writer, info["queue"], None)
+        for writer in self.conns.difference(self.clients):
+            writer.close()
+        self.clients.clear()
+        await self.server.wait_closed()
+        self.server = None
+        # handlers end once their writer task has flushed and closed the connection
+        if self.tasks:
+            await asyncio.wait(list(self.tasks), timeout=2)
+        if self.history is not None:
+            self.history.close(); self.history = None
+        self.closed.set()
+        print("[*] Group server stopped.")
+    async def serve(self):
+        """Headless: run until stop() is called (or the task is cancelled)."""
+        await self.start()
+        try:
+            await self.closed.wait()
+        finally:
+            await self.stop()
+    async def serve_console(self):
+        """Run until /exit (or EOF) on stdin; typed lines are broadcast as the host."""
+        await self.start()
+        loop = asyncio.get_running_loop()
+        lines = asyncio.Queue()
+        def read_stdin():
+            # ends itself on /exit so no stray reader is left eating menu input
+            line = None
+            try:
+                while True:
+                    line = input()
+                    if line.strip().lower() in ("/exit","/quit"):
+                        line = None; break
+                    loop.call_soon_threadsafe(lines.put_nowait, line)
+            except (EOFError, KeyboardInterrupt, RuntimeError):
+                line = None
+            try:
+                loop.call_soon_threadsafe(lines.put_nowait, line)
+            except RuntimeError:
+                pass  # loop already closed
+        threading.Thread(target=read_stdin, daemon=True).start()
+        try:
+            while True:
+                line = await lines.get()
+                if line is None:
+                    break
+                self.broadcast_plain(self.name, line)
+        finally:
+            await self.stop()
+
+def bench_group_broadcast(clients=500, size=1024, rounds=20):
+    """Per-client cost of one broadcast to `clients` in-memory peers, re-encrypting for
+    every peer (the old fan-out) versus AsyncGroupServer.broadcast_plain()."""
+    gs = AsyncGroupServer("127.0.0.1", 0, "bench", "Bench")
+    gs.key = derive_key(gs.pin, gs.salt)
+    gs.ciphers = {v: ChatCipher(gs.key, v) for v in CHAT_VERSIONS}
+    text = "x" * size
+    def per_client(sender_name, plaintext):
+        for writer, info in gs.clients.items():
+            ct = gs.ciphers[info["v"]].encrypt(plaintext.encode('utf-8'))
+            gs._enqueue(writer, info["queue"], gs.frame({"type":"msg","name":sender_name,"ct": base64.b64encode(ct).decode()}))
+    async def run():
+        timings = {}
+        for label, fn in (("per-client", per_client), ("encrypt-once", gs.broadcast_plain)):
+            gs.clients = {i: {"name": f"c{i}", "addr": None, "v": CHAT_VERSIONS[-1], "binary": False, "queue": asyncio.Queue()} for i in range(clients)}
+            t0 = time.perf_counter()
+            for _ in range(rounds):
+                fn("bench", text)
+            timings[label] = (time.perf_counter() - t0) / (rounds * clients)
+        return timings
+    timings = asyncio.run(run())
+    print(f"{clients} clients, {size} byte message, {rounds} rounds")
+    for label, per in timings.items():
+        print(f"  {label:<13} {per * 1e6:9.2f} us/client")
+    print(f"  speedup       {timings['per-client'] / timings['encrypt-once']:9.1f}x")
+    return timings
+
+class AsyncGroupClient:
+    """Scriptable group client for AsyncGroupServer: no input()/getpass(), negotiates
+    like run_group_client() and hands messages back from recv(). Clients given the same
+    `keys` dict share derived keys (salt -> key), so many of them joining one server
+    run PBKDF2 once; it lives only as long as the caller keeps it."""
+    def __init__(self, host, port, pin, name, binary=True, version=None, keys=None):
+        self.host, self.port, self.pin, self.name = host, port, pin, name
+        self.binary, self.version = binary, version
+        self.keys = {} if keys is None else keys
+        self.reader = self.writer = self.cipher = None
+        self.frames = FrameReader()
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, limit=CHAT_LINE_LIMIT)
+        hello = decode_line(await self.reader.readline())
+        if hello.get("type") != "salt":
+            raise ConnectionError("invalid handshake")
+        salt = base64.b64decode(hello.get("salt"))
+        version = self.version or chat_version(hello.get("versions"))
+        if version is None:
+            raise ConnectionError("no common protocol version")
+        self.binary = self.binary and "binary" in (hello.get("framing") or [])
+        key = self.keys.get(salt)
+        if key is None:
+            key = self.keys[salt] = await asyncio.get_running_loop().run_in_executor(None, derive_key, self.pin, salt)
+        self.cipher = ChatCipher(key, version)
+        join = {"type":"join","name":self.name,"v":version}
+        if self.binary:
+            join["framing"] = "binary"
+        self.writer.write(json.dumps(join).encode('utf-8') + b'\n')
+        await self.writer.drain()
+        return self
+    async def send(self, text):
+        self.writer.write(encode_msg(self.name, self.cipher.encrypt(text.encode('utf-8')), self.binary))
+        await self.writer.drain()
+    async def history(self, **query):
+        """Ask for history (last= / since= / until= / sender= / limit=); the answer
+        arrives through recv() as "history" messages with their entries in "items"."""
+        self.writer.write(encode_ctrl(dict(query, type="history"), self.binary))
+        await self.writer.drain()
+    async def recv(self):
+        """Next message as a dict (a msg gets its plaintext in "text"), or None at EOF."""
+        while True:
+            if self.binary:
+                item = self.frames.frame()
+                if item is None:
+                    data = await self.reader.read(1 << 16)
+                    if not data:
+                        return None
+                    self.frames.feed(data)
+                    continue
+                m = decode_frame(*item)
+            else:
+                raw = await self.reader.readline()
+                if not raw:
+                    return None
+                m = decode_line(raw)
+            if m.get("type") == "msg":
+                try:
+                    m["text"] = self.cipher.decrypt(m.get("ct")).decode('utf-8', errors='ignore')
+                except:
+                    continue
+            elif m.get("type") == "history":
+                try:
+                    m["items"] = json.loads(self.cipher.decrypt(base64.b64decode(m.get("ct")), b"history"))
+                except:
+                    continue
+            return m
+    async def close(self):
+        if self.writer is None:
+            return
+        try:
+            self.writer.write(pack_frame(FRAME_CLOSE) if self.binary else b'{"type":"leave"}\n')
+            await self.writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        self.writer.close()
+        self.writer = None
+
+def raise_fd_limit():
+    """Lift the soft open-files limit to the hard one; a thousand sockets need it."""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        want = hard if hard != resource.RLIM_INFINITY else 65536
+        if soft != resource.RLIM_INFINITY and soft < want:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (want, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+def serve_group_headless(bind, port, pin, name="GroupHost", quiet=False, history=None):
+    """Group server without a console, until Ctrl-C or SIGTERM."""
+    raise_fd_limit()
+    async def main():
+        gs = AsyncGroupServer(bind, port, pin, name, quiet=quiet, history=history)
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(gs.stop()))
+        except (NotImplementedError, RuntimeError, AttributeError):
+            pass  # no signal handlers on this platform
+        await gs.serve()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    except (OSError, ValueError) as e:
+        print("Could not start group server:", e)
+
+def proc_usage(pid):
+    """(CPU seconds, RSS bytes, peak RSS bytes) of a process from /proc, or None."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        mem = {}
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    mem[line[:5]] = int(line.split()[1]) * 1024
+        return cpu, mem.get("VmRSS", 0), mem.get("VmHWM", 0)
+    except (OSError, ValueError, IndexError):
+        return None
+
+def chat_load_test(clients=100, rate=50.0, duration=10.0, size=64, senders=None, host=None, port=None,
+                   pin="load-test", binary=True, version=None):
+    """Connect `clients` AsyncGroupClients, have `senders` of them (default all) send
+    `rate` messages/s in total for `duration` seconds, and report broadcast latency
+    percentiles, throughput and the server's CPU and RSS. Without host/port a headless
+    server is started in a subprocess so its usage can be read from /proc."""
+    raise_fd_limit()
+    senders = min(senders or clients, clients)
+    server = scratch = None
+    if host is None:
+        scratch = tempfile.TemporaryDirectory()  # the server's message history
+        host = "127.0.0.1"
+        with socket.socket() as probe:
+            probe.bind((host, 0))
+            port = probe.getsockname()[1]
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "chat-serve", "--bind", host,
+                                   "--port", str(port), "--pin", pin, "--quiet",
+                                   "--history", os.path.join(scratch.name, "group.log")],
+                                  stdout=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
+    latencies = []
+    counts = {"sent": 0, "delivered": 0, "dropped": 0}
+    async def receive(client):
+        while True:
+            m = await client.recv()
+            if m is None:
+                return
+            text = m.get("text") or ""
+            if text.startswith("LG "):
+                latencies.append(time.perf_counter() - float(text.split(" ", 3)[2]))
+                counts["delivered"] += 1
+    async def send(client, idx, deadline):
+        loop = asyncio.get_running_loop()
+        interval = senders / rate
+        next_at = loop.time() + random.random() * interval  # spread senders over one interval
+        seq = 0
+        while next_at < deadline:
+            await asyncio.sleep(max(0.0, next_at - loop.time()))
+            text = f"LG {idx} {time.perf_counter()!r} {seq} "
+            try:
+                await client.send(text + "x" * max(0, size - len(text)))
+            except (ConnectionError, OSError):
+                counts["dropped"] += 1  # the server cut this client off
+                return
+            counts["sent"] += 1
+            seq += 1
+            next_at += interval
+    readers, keys = [], {}
+    async def join(i):
+        client = await AsyncGroupClient(host, port, pin, f"lg{i}", binary, version, keys).connect()
+        readers.append(asyncio.ensure_future(receive(client)))  # read join notices right away or get dropped
+        return client
+    async def run():
+        for _ in range(100):  # wait for the server to listen
+            try:
+                conns = [await join(0)]
+                break
+            except OSError:
+                await asyncio.sleep(0.1)
+        else:
+            raise ConnectionError(f"no chat server on {host}:{port}")
+        # the first join derived the key, so the rest find it in `keys`; joining
+        # in small waves lets everyone read the join notices before their queues fill
+        for start in range(1, clients, 50):
+            conns += await asyncio.gather(*(join(i) for i in range(start, min(start + 50, clients))))
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(1.0)  # let the join broadcasts drain
+        latencies.clear()
+        before = proc_usage(server.pid) if server else None
+        mine, t0 = time.process_time(), time.perf_counter()
+        deadline = asyncio.get_running_loop().time() + duration
+        await asyncio.gather(*(send(conns[i], i, deadline) for i in range(senders)))
+        expected = counts["sent"] * clients
+        settle = time.perf_counter() + 5
+        while counts["delivered"] < expected and time.perf_counter() < settle:
+            await asyncio.sleep(0.05)
+        wall = time.perf_counter() - t0
+        after = proc_usage(server.pid) if server else None
+        mine = time.process_time() - mine
+        for c in conns:
+            await c.close()
+        for r in readers:
+            r.cancel()
+        return wall, before, after, mine, expected
+    try:
+        wall, before, after, mine, expected = asyncio.run(run())
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+            scratch.cleanup()
+    latencies.sort()
+    pct = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else float("nan")
+    report = {"clients": clients, "senders": senders, "rate": rate, "duration": duration, "size": size,
+              "sent": counts["sent"], "delivered": counts["delivered"], "expected": expected,
+              "dropped_senders": counts["dropped"], "wall_seconds": wall,
+              "msgs_per_s": counts["sent"] / wall, "deliveries_per_s": counts["delivered"] / wall,
+              "p50_ms": pct(0.50), "p99_ms": pct(0.99), "max_ms": pct(1.0), "loadgen_cpu": mine / wall}
+    if before and after:
+        report.update(server_cpu=(after[0] - before[0]) / wall, server_rss=after[1], server_peak_rss=after[2])
+    print(f"{clients} clients, {senders} senders, {rate:g} msg/s for {duration:g}s, {size} byte messages")
+    print(f"sent {report['sent']} ({report['msgs_per_s']:.1f}/s), delivered {report['delivered']}/{expected} "
+          f"({report['deliveries_per_s']:.0f}/s)" + (f", {counts['dropped']} senders dropped" if counts["dropped"] else ""))
+    print(f"broadcast latency p50 {report['p50_ms']:.2f} ms, p99 {report['p99_ms']:.2f} ms, max {report['max_ms']:.2f} ms")
+    if "server_cpu" in report:
+        print(f"server CPU {report['server_cpu'] * 100:.0f}% of a core, RSS {report['server_rss'] / 1048576:.1f} MiB "
+              f"(peak {report['server_peak_rss'] / 1048576:.1f} MiB)")
+    print(f"load generator CPU {report['loadgen_cpu'] * 100:.0f}% of a core")
+    return report
+
+def run_group_server(bind, port, pin, name, history=None):
+    try:
+        asyncio.run(AsyncGroupServer(bind, port, pin, name, history=history).serve_console())
+    except KeyboardInterrupt:
+        print("[*] Group server stopped.")
+    except (OSError, ValueError) as e:
+        print("Could not start group server:", e)
+
+# ---------------- Termux Secure Chat (embedded) ----------------
+def termux_chat_menu():
+    print("\nLaunching Termux Secure Chat v2 (menued).")
+    print("This will run a lightweight menu for Host/Client/Group.")
+    press_enter()
     # single host/client and group server/client functions (kept concise)
     def run_host_single(lhost, port):
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -633,22 +3609,33 @@ def termux_chat_menu():
         print(f"[+] Listening on {my_ip}:{port}")
         conn, addr = s.accept()
         print(f"[+] Connected: {addr}")
+        chat = ChatConn(conn)
         salt = token_bytes(16)
-        send_json_line(conn, {"type":"salt","salt": base64.b64encode(salt).decode()})
+        chat.send_json({"type":"salt","salt": base64.b64encode(salt).decode(),"versions": CHAT_VERSIONS,"framing": CHAT_FRAMINGS})
         name = input("Your name: ").strip() or "Host"
         pin = getpass("Set shared PIN: ").strip()
         key = derive_key(pin, salt)
-        print("[*] Chat started. /exit to quit.")
+        cipher = ChatCipher(key, CHAT_V_XOR)  # until the client's hello picks a newer version
+        files = FileTransfers(chat, lambda: cipher, name)
+        print("[*] Chat started. /send <file> to share a file, /exit to quit.")
         stop_event = threading.Event()
         def recv_loop():
-            for raw in recv_lines(conn):
-                if stop_event.is_set(): break
-                try:
-                    obj = json.loads(raw.decode('utf-8', errors='ignore'))
-                except: continue
-                if obj.get("type") == "msg":
+            nonlocal cipher
+            while not stop_event.is_set():
+                obj = chat.recv()
+                if obj is None: break
+                if files.handle(obj): continue
+                if obj.get("type") == "hello":
+                    version = chat_version([obj.get("v")])
+                    if version:
+                        cipher = ChatCipher(key, version)
+                    if obj.get("framing") == "binary":
+                        # the client frames everything after its hello; we switch after our ack
+                        chat.binary_in = True
+                        chat.start_binary_out({"type":"hello_ack","framing":"binary"})
+                elif obj.get("type") == "msg":
                     try:
-                        ct = base64.b64decode(obj.get("ct")); pt = xor_bytes(ct, key).decode('utf-8', errors='ignore')
+                        pt = cipher.decrypt(obj.get("ct")).decode('utf-8', errors='ignore')
                         print(f"\n🔒 {obj.get('name')}: {pt}")
                     except:
                         print("\n[!] Corrupt or wrong PIN.")
@@ -660,49 +3647,56 @@ def termux_chat_menu():
                 while not stop_event.is_set():
                     sline = input()
                     if sline.strip().lower() in ("/exit","/quit"):
-                        send_json_line(conn, {"type":"close"}); stop_event.set(); break
+                        chat.send_close(); stop_event.set(); break
                     if sline=="": continue
-                    ct = xor_bytes(sline.encode('utf-8'), key)
-                    send_json_line(conn, {"type":"msg","name":name,"ct": base64.b64encode(ct).decode()})
+                    if files.command(sline): continue
+                    chat.send_msg(name, cipher.encrypt(sline.encode('utf-8')))
             except:
                 stop_event.set()
         rt = threading.Thread(target=recv_loop, daemon=True); rt.start()
         it = threading.Thread(target=input_loop, daemon=True); it.start()
         rt.join(); it.join()
-        conn.close(); s.close(); print("[*] Host chat ended.")
+        files.close(); chat.close(); s.close(); print("[*] Host chat ended.")
     def run_client_single(host, port):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
             sock.connect((host, port))
         except Exception as e:
             print("Unable to connect:", e); return
-        lines = recv_lines(sock)
-        try:
-            first = next(lines)
-        except StopIteration:
-            print("Connection closed"); sock.close(); return
-        try:
-            obj = json.loads(first.decode('utf-8', errors='ignore'))
-        except:
-            print("Invalid handshake"); sock.close(); return
+        chat = ChatConn(sock)
+        obj = chat.recv()
+        if obj is None:
+            print("Connection closed"); chat.close(); return
         if obj.get("type")!="salt":
-            print("Invalid handshake"); sock.close(); return
+            print("Invalid handshake"); chat.close(); return
         salt = base64.b64decode(obj.get("salt"))
+        version = chat_version(obj.get("versions"))
+        if version is None:
+            print("No common protocol version with host"); chat.close(); return
+        binary = "binary" in (obj.get("framing") or [])
+        if version > CHAT_V_XOR or binary:
+            hello = {"type":"hello","v":version}
+            if binary:
+                hello["framing"] = "binary"
+            chat.send_json(hello)
+            chat.binary_out = binary
         name = input("Your name: ").strip() or "Client"
         pin = getpass("Enter shared PIN: ").strip()
         key = derive_key(pin, salt)
-        print("[*] Chat started. /exit to quit.")
+        cipher = ChatCipher(key, version)
+        files = FileTransfers(chat, lambda: cipher, name)
+        print("[*] Chat started. /send <file> to share a file, /exit to quit.")
         stop_event = threading.Event()
         def recv_loop():
-            for raw in lines:
-                if stop_event.is_set(): break
-                try:
-                    o = json.loads(raw.decode('utf-8', errors='ignore'))
-                except:
-                    continue
-                if o.get("type")=="msg":
+            while not stop_event.is_set():
+                o = chat.recv()
+                if o is None: break
+                if files.handle(o): continue
+                if o.get("type")=="hello_ack":
+                    chat.binary_in = o.get("framing") == "binary"
+                elif o.get("type")=="msg":
                     try:
-                        ct = base64.b64decode(o.get("ct")); pt = xor_bytes(ct, key).decode('utf-8', errors='ignore')
+                        pt = cipher.decrypt(o.get("ct")).decode('utf-8', errors='ignore')
                         print(f"\n🔒 {o.get('name')}: {pt}")
                     except:
                         print("\n[!] Corrupt or wrong PIN.")
@@ -714,146 +3708,73 @@ def termux_chat_menu():
                 while not stop_event.is_set():
                     sline = input()
                     if sline.strip().lower() in ("/exit","/quit"):
-                        send_json_line(sock, {"type":"close"}); stop_event.set(); break
+                        chat.send_close(); stop_event.set(); break
                     if sline=="": continue
-                    ct = xor_bytes(sline.encode('utf-8'), key)
-                    send_json_line(sock, {"type":"msg","name":name,"ct": base64.b64encode(ct).decode()})
+                    if files.command(sline): continue
+                    chat.send_msg(name, cipher.encrypt(sline.encode('utf-8')))
             except:
                 stop_event.set()
         rt = threading.Thread(target=recv_loop, daemon=True); rt.start()
         it = threading.Thread(target=input_loop, daemon=True); it.start()
         rt.join(); it.join()
-        sock.close(); print("[*] Client ended.")
-    def run_group_server(bind, port, pin, name):
-        class GS:
-            def __init__(self, bind, port, pin, name):
-                self.bind=bind; self.port=port; self.pin=pin; self.name=name
-                self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM); self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR,1)
-                self.clients={}; self.lock=threading.Lock(); self.salt = token_bytes(16); self.running=False
-            def start(self):
-                self.s.bind((self.bind,self.port)); self.s.listen(50); self.running=True
-                print(f"Group server on {self.bind}:{self.port}")
-                threading.Thread(target=self.accept_loop, daemon=True).start()
-                try:
-                    while self.running:
-                        line = input()
-                        if line.strip().lower() in ("/exit","/quit"): self.stop(); break
-                        self.broadcast_plain(self.name, line)
-                except KeyboardInterrupt:
-                    self.stop()
-            def accept_loop(self):
-                while self.running:
-                    try:
-                        conn, addr = self.s.accept()
-                    except:
-                        break
-                    threading.Thread(target=self.handle_client, args=(conn,addr), daemon=True).start()
-            def handle_client(self, conn, addr):
-                try:
-                    send_json_line(conn, {"type":"salt","salt": base64.b64encode(self.salt).decode()})
-                    lines = recv_lines(conn)
-                    try:
-                        first = next(lines)
-                    except StopIteration:
-                        conn.close(); return
-                    try:
-                        obj = json.loads(first.decode('utf-8', errors='ignore'))
-                    except:
-                        conn.close(); return
-                    if obj.get("type")!="join":
-                        conn.close(); return
-                    cname = obj.get("name") or "Anon"
-                    key = derive_key(self.pin, self.salt)
-                    with self.lock:
-                        self.clients[conn] = {"name":cname,"key":key,"addr":addr}
-                    print(f"[+] {cname} joined from {addr}")
-                    self.broadcast_system(f"{cname} joined the group.")
-                    for raw in lines:
-                        try:
-                            m = json.loads(raw.decode('utf-8', errors='ignore'))
-                        except:
-                            continue
-                        if m.get("type")=="msg":
-                            try:
-                                ct = base64.b64decode(m.get("ct")); pt = xor_bytes(ct, key).decode('utf-8', errors='ignore')
-                                self.broadcast_plain(m.get("name"), pt)
-                            except:
-                                continue
-                        elif m.get("type")=="leave":
-                            break
-                finally:
-                    with self.lock:
-                        info = self.clients.pop(conn, None)
-                    if info:
-                        self.broadcast_system(f"{info.get('name')} left the group.")
-                        print(f"[-] {info.get('name')} disconnected.")
-                    try: conn.close()
-                    except: pass
-            def broadcast_plain(self, sender_name, plaintext):
-                with self.lock:
-                    conns = list(self.clients.items())
-                for conn, info in conns:
-                    try:
-                        key = info.get("key"); ct = xor_bytes(plaintext.encode('utf-8'), key)
-                        send_json_line(conn, {"type":"msg","name":sender_name,"ct": base64.b64encode(ct).decode()})
-                    except:
-                        with self.lock:
-                            if conn in self.clients:
-                                self.clients.pop(conn)
-                                try: conn.close()
-                                except: pass
-            def broadcast_system(self, text):
-                self.broadcast_plain("System", text)
-            def stop(self):
-                self.running=False
-                try: self.s.close()
-                except: pass
-                with self.lock:
-                    for c in list(self.clients.keys()):
-                        try: send_json_line(c, {"type":"server_close"}); c.close()
-                        except: pass
-                    self.clients.clear()
-                print("[*] Group server stopped.")
-        gs = GS(bind, port, pin, name); gs.start()
+        files.close(); chat.close(); print("[*] Client ended.")
     def run_group_client(host, port):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
             sock.connect((host, port))
         except Exception as e:
             print("Could not connect:", e); return
-        lines = recv_lines(sock)
-        try:
-            first = next(lines)
-        except StopIteration:
-            print("Disconnected by server"); sock.close(); return
-        try:
-            obj = json.loads(first.decode('utf-8', errors='ignore'))
-        except:
-            print("Invalid handshake"); sock.close(); return
+        chat = ChatConn(sock)
+        obj = chat.recv()
+        if obj is None:
+            print("Disconnected by server"); chat.close(); return
         if obj.get("type")!="salt":
-            print("Invalid handshake"); sock.close(); return
+            print("Invalid handshake"); chat.close(); return
         salt = base64.b64decode(obj.get("salt"))
+        version = chat_version(obj.get("versions"))
+        if version is None:
+            print("No common protocol version with server"); chat.close(); return
+        binary = "binary" in (obj.get("framing") or [])
         name = input("Your name: ").strip() or "Anon"
         pin = getpass("Enter group PIN: ").strip()
         key = derive_key(pin, salt)
-        send_json_line(sock, {"type":"join","name":name})
-        print("[*] Joined group. /exit to leave.")
+        cipher = ChatCipher(key, version)
+        join = {"type":"join","name":name,"v":version}
+        if binary:
+            join["framing"] = "binary"
+        chat.send_json(join)
+        # the server answers a binary join in frames only, so both directions switch now
+        chat.binary_in = chat.binary_out = binary
+        files = FileTransfers(chat, lambda: cipher, name)
+        if obj.get("history"):
+            print("[*] This group keeps an encrypted message history on the server.")
+            chat.send_ctrl({"type":"history","last":CHAT_HISTORY_JOIN})
+            print("[*] Joined group. /send <file> to share a file, /history [N | <minutes>m] [@name] for older messages, /exit to leave.")
+        else:
+            print("[*] Joined group. /send <file> to share a file, /exit to leave.")
         stop_event = threading.Event()
         def recv_loop():
-            for raw in lines:
-                if stop_event.is_set(): break
-                try:
-                    o = json.loads(raw.decode('utf-8', errors='ignore'))
-                except:
-                    continue
+            while not stop_event.is_set():
+                o = chat.recv()
+                if o is None: break
+                if files.handle(o): continue
                 t = o.get("type")
                 if t=="msg":
                     try:
-                        ct = base64.b64decode(o.get("ct")); pt = xor_bytes(ct, key).decode('utf-8', errors='ignore')
+                        pt = cipher.decrypt(o.get("ct")).decode('utf-8', errors='ignore')
                         print(f"\n🔒 {o.get('name')}: {pt}")
                     except:
                         print("\n[!] Corrupt or wrong PIN.")
-                elif t=="server_close":
+                elif t=="history":
+                    try:
+                        items = json.loads(cipher.decrypt(base64.b64decode(o.get("ct")), b"history"))
+                    except:
+                        print("\n[!] Unreadable history."); continue
+                    for it in items:
+                        print(f"  [{time.strftime('%d %b %H:%M', time.localtime(it['ts']))}] {it['name']}: {it['text']}")
+                    if o.get("done") and o.get("more"):
+                        print("[*] More history matched than was sent; narrow it with /history.")
+                elif t in ("server_close","close"):
                     print("\n[!] Server closed."); stop_event.set(); break
             stop_event.set()
         def input_loop():
@@ -861,16 +3782,26 @@ def termux_chat_menu():
                 while not stop_event.is_set():
                     sline = input()
                     if sline.strip().lower() in ("/exit","/quit"):
-                        send_json_line(sock, {"type":"leave"}); stop_event.set(); break
+                        chat.send_close("leave"); stop_event.set(); break
                     if sline=="": continue
-                    ct = xor_bytes(sline.encode('utf-8'), key)
-                    send_json_line(sock, {"type":"msg","name":name,"ct": base64.b64encode(ct).decode()})
+                    if files.command(sline): continue
+                    if sline.split(" ", 1)[0] == "/history":
+                        query = {"type":"history","last":CHAT_HISTORY_JOIN}
+                        for arg in sline.split()[1:]:
+                            if arg.startswith("@"):
+                                query["sender"] = arg[1:]
+                            elif arg.endswith("m") and arg[:-1].isdigit():
+                                query.pop("last", None); query["since"] = time.time() - int(arg[:-1]) * 60
+                            elif arg.isdigit():
+                                query["last"] = int(arg)
+                        chat.send_ctrl(query); continue
+                    chat.send_msg(name, cipher.encrypt(sline.encode('utf-8')))
             except:
                 stop_event.set()
         rt = threading.Thread(target=recv_loop, daemon=True); rt.start()
         it = threading.Thread(target=input_loop, daemon=True); it.start()
         rt.join(); it.join()
-        sock.close(); print("[*] Left group.")
+        files.close(); chat.close(); print("[*] Left group.")
     # menu
     while True:
         print("\n=== Termux Secure Chat v2 ===")
@@ -893,7 +3824,10 @@ def termux_chat_menu():
             port = int(input("Port (9000): ").strip() or "9000")
             name = input("Server display name: ").strip() or "GroupHost"
             pin = getpass("Set group PIN: ").strip()
-            run_group_server(bind, port, pin, name)
+            history = None
+            if input("Keep an encrypted message history on this device for members to fetch? (y/N): ").strip().lower() == "y":
+                history = input(f"History file ({CHAT_HISTORY_FILE}): ").strip() or CHAT_HISTORY_FILE
+            run_group_server(bind, port, pin, name, history)
         elif choice == "4":
             host = input("Group server IP: ").strip() or "127.0.0.1"
             port = int(input("Port (9000): ").strip() or "9000")
@@ -903,6 +3837,66 @@ def termux_chat_menu():
         else:
             print("Invalid.")
 
+# ---------------- Command line ----------------
+def cli(argv):
+    """Non-interactive entry points; running without arguments opens the menu."""
+    import argparse
+    parser = argparse.ArgumentParser(prog="kami_max_toolkit.py", description="Kami Max Toolkit batch commands")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("stego-batch", help="run audio/image stego jobs from a CSV or JSONL manifest")
+    p.add_argument("manifest", help="columns: mode, cover, secret, output[, lsbs]")
+    p.add_argument("--results", help="JSONL results file (default <manifest>.results.jsonl)")
+    p.add_argument("--workers", type=int, help="processes (default: CPU count)")
+    p = sub.add_parser("qr-batch", help="render QR codes from a CSV or JSONL manifest into one archive")
+    p.add_argument("manifest", help="columns: data, name[, watermark]")
+    p.add_argument("output", help="a .zip archive, or a directory for a file per code")
+    p.add_argument("--format", choices=list(QR_BATCH_FORMATS), default="png",
+                   help="png, svg, or raw (modules packed one bit each)")
+    p.add_argument("--watermark", default="KamixChatGPT", help="watermark for rows without one ('' for none)")
+    p.add_argument("--workers", type=int, help="processes (default: CPU count)")
+    p = sub.add_parser("chat-bench", help="measure group broadcast cost per client")
+    p.add_argument("--clients", type=int, default=500)
+    p.add_argument("--size", type=int, default=1024, help="message bytes")
+    p.add_argument("--rounds", type=int, default=20)
+    p = sub.add_parser("chat-serve", help="run a group chat server without a console")
+    p.add_argument("--bind", default="0.0.0.0")
+    p.add_argument("--port", type=int, default=9000)
+    p.add_argument("--pin", default=os.environ.get("KAMI_CHAT_PIN"), help="group PIN (default $KAMI_CHAT_PIN, else prompt)")
+    p.add_argument("--name", default="GroupHost")
+    p.add_argument("--quiet", action="store_true", help="don't log joins and leaves")
+    p.add_argument("--history", metavar="PATH", help="keep an encrypted message history in this log (off by default)")
+    p = sub.add_parser("chat-load", help="load-test a group chat server with simulated clients")
+    p.add_argument("--clients", type=int, default=100)
+    p.add_argument("--senders", type=int, help="clients that send (default all)")
+    p.add_argument("--rate", type=float, default=50.0, help="messages/s across all senders")
+    p.add_argument("--duration", type=float, default=10.0, help="seconds of sending")
+    p.add_argument("--size", type=int, default=64, help="message bytes")
+    p.add_argument("--connect", metavar="HOST:PORT", help="use a running server instead of starting one")
+    p.add_argument("--pin", default="load-test")
+    p.add_argument("--json-lines", action="store_true", help="use JSON framing instead of binary frames")
+    p.add_argument("--legacy", action="store_true", help="use the legacy XOR cipher")
+    p.add_argument("--report", help="also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+    if args.command == "stego-batch":
+        run_stego_batch(args.manifest, args.results, args.workers)
+    elif args.command == "qr-batch":
+        run_qr_batch(args.manifest, args.output, args.format, args.workers, args.watermark)
+    elif args.command == "chat-bench":
+        bench_group_broadcast(args.clients, args.size, args.rounds)
+    elif args.command == "chat-serve":
+        serve_group_headless(args.bind, args.port, args.pin or getpass("Set group PIN: ").strip(), args.name, args.quiet,
+                             args.history)
+    elif args.command == "chat-load":
+        host = port = None
+        if args.connect:
+            host, _, port = args.connect.rpartition(":")
+            port = int(port)
+        report = chat_load_test(args.clients, args.rate, args.duration, args.size, args.senders, host, port, args.pin,
+                                not args.json_lines, CHAT_V_XOR if args.legacy else None)
+        if args.report:
+            with open(args.report, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+
 # ---------------- Main Menu ----------------
 def main_menu():
     while True:
@@ -934,6 +3928,9 @@ def main_menu():
 
 if __name__ == "__main__":
     try:
-        main_menu()
+        if len(sys.argv) > 1:
+            cli(sys.argv[1:])
+        else:
+            main_menu()
     except KeyboardInterrupt:
         print("\nExiting...")
@@ -15,7 +15,7 @@ done
 echo "✅ Termux packages installed."
 
 echo "📦 Installing Python packages..."
-PY_PKGS=(Pillow qrcode opencv-python requests cryptography pycryptodome colorama)
+PY_PKGS=(Pillow numpy qrcode opencv-python requests cryptography pycryptodome colorama)
 for p in "${PY_PKGS[@]}"; do
     echo "Installing $p..."
     pip install "$p"
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import socket
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import kami_max_toolkit as kmt
+
+FID = "0123456789abcdef0123456789abcdef"
+
+
+def frames_of(data, step):
+    """Frames decoded from `data` fed `step` bytes at a time."""
+    reader, out = kmt.FrameReader(size=16), []
+    for i in range(0, len(data), step):
+        reader.feed(data[i:i + step])
+        while (item := reader.frame()) is not None:
+            out.append(kmt.decode_frame(*item))
+    return out
+
+
+@pytest.mark.parametrize("step", [1, 7, 1 << 20])
+def test_binary_frames_roundtrip(step):
+    ct = os.urandom(3000)
+    data = (kmt.encode_msg("Ålice", ct, True) + kmt.encode_ctrl({"type": "file_ack", "id": FID, "next": 3}, True)
+            + kmt.encode_chunk(FID, 2**40, ct, True) + kmt.pack_frame(kmt.FRAME_CLOSE))
+    assert frames_of(data, step) == [{"type": "msg", "name": "Ålice", "ct": ct},
+                                     {"type": "file_ack", "id": FID, "next": 3},
+                                     {"type": "file_chunk", "id": FID, "seq": 2**40, "ct": ct},
+                                     {"type": "close"}]
+
+
+def test_json_lines_roundtrip():
+    ct = os.urandom(100)
+    reader = kmt.FrameReader(size=16)
+    reader.feed(kmt.encode_msg("bob", ct, False) + kmt.encode_chunk(FID, 5, ct, False) + b"[1]\n{bad\n")
+    lines = [kmt.decode_line(reader.line()) for _ in range(4)]
+    assert lines == [{"type": "msg", "name": "bob", "ct": ct},
+                     {"type": "file_chunk", "id": FID, "seq": 5, "ct": ct}, {}, {}]
+    assert reader.line() is None
+
+
+def test_oversized_frame_is_refused():
+    reader = kmt.FrameReader()
+    reader.feed(kmt.FRAME_HEADER.pack(kmt.FRAME_MAX + 1, kmt.FRAME_MSG))
+    with pytest.raises(ValueError):
+        reader.frame()
+
+
+def test_version_negotiation():
+    assert kmt.chat_version(None) == kmt.CHAT_V_XOR
+    assert kmt.chat_version([kmt.CHAT_V_XOR, 99]) == kmt.CHAT_V_XOR
+    assert kmt.chat_version([99]) is None
+
+
+def test_xor_cipher_roundtrip():
+    cipher = kmt.ChatCipher(os.urandom(32), kmt.CHAT_V_XOR)
+    assert cipher.decrypt(cipher.encrypt(b"hello there")) == b"hello there"
+
+
+@pytest.mark.skipif(not kmt.CRYPTO_OK, reason="needs the cryptography package")
+def test_aesgcm_cipher_authenticates():
+    key = kmt.derive_key("1234", b"s" * 16)
+    cipher = kmt.ChatCipher(key, kmt.CHAT_V_AESGCM)
+    ct = cipher.encrypt(b"secret", b"aad")
+    assert ct != cipher.encrypt(b"secret", b"aad")  # fresh nonce each time
+    assert cipher.decrypt(ct, b"aad") == b"secret"
+    tampered = ct[:-1] + bytes([ct[-1] ^ 1])
+    for bad in ((tampered, b"aad"), (ct, b"other aad"), (ct, None)):
+        with pytest.raises(ValueError):
+            cipher.decrypt(*bad)
+    with pytest.raises(ValueError):
+        kmt.ChatCipher(kmt.derive_key("4321", b"s" * 16), kmt.CHAT_V_AESGCM).decrypt(ct, b"aad")
+
+
+class Pair:
+    """Two FileTransfers joined by a socketpair, each with its receive loop running."""
+    def __init__(self, outdir, version=kmt.CHAT_V_XOR, binary=True):
+        a, b = socket.socketpair()
+        cipher = kmt.ChatCipher(os.urandom(32), version)
+        self.conns = [kmt.ChatConn(a), kmt.ChatConn(b)]
+        for conn in self.conns:
+            conn.binary_in = conn.binary_out = binary
+        self.sender = kmt.FileTransfers(self.conns[0], lambda: cipher, "alice", str(outdir / "unused"))
+        self.receiver = kmt.FileTransfers(self.conns[1], lambda: cipher, "bob", str(outdir))
+        self.sent = []
+        send_chunk = self.conns[0].send_chunk
+        self.conns[0].send_chunk = lambda fid, seq, ct: (self.sent.append(seq), send_chunk(fid, seq, ct))
+        self.offered = threading.Event()
+        for conn, files in zip(self.conns, (self.sender, self.receiver)):
+            threading.Thread(target=self._loop, args=(conn, files), daemon=True).start()
+    def _loop(self, conn, files):
+        while (obj := conn.recv()) is not None:
+            files.handle(obj)
+            if obj.get("type") == "file_offer":
+                self.offered.set()
+    def send(self, path, answer="/accept", chunk=1024):
+        sender = kmt.FileSender(self.conns[0], str(path), chunk=chunk)
+        threading.Thread(target=lambda: self.offered.wait(10) and self.receiver.command(answer), daemon=True).start()
+        return sender.run(self.sender.cipher_fn, "alice", lambda s: self.sender.senders.__setitem__(s.fid, s))
+    def close(self):
+        for conn in self.conns:
+            conn.close()
+
+
+@pytest.fixture
+def secret(tmp_path):
+    path = tmp_path / "secret.bin"
+    path.write_bytes(os.urandom(20 * 1024 + 500))
+    return path
+
+
+@pytest.mark.parametrize("version,binary", [(kmt.CHAT_V_XOR, False)] +
+                         ([(kmt.CHAT_V_AESGCM, True)] if kmt.CRYPTO_OK else []))
+def test_file_transfer_roundtrip(tmp_path, secret, version, binary):
+    pair = Pair(tmp_path / "in", version, binary)
+    try:
+        assert pair.send(secret)
+    finally:
+        pair.close()
+    assert (tmp_path / "in" / "secret.bin").read_bytes() == secret.read_bytes()
+    assert pair.sent == list(range(21))
+
+
+def test_file_transfer_resumes_from_part_file(tmp_path, secret):
+    data = secret.read_bytes()
+    fid = kmt.chat_file_id("secret.bin", len(data), hashlib.sha256(data).hexdigest())
+    (tmp_path / "in").mkdir()
+    # 7 whole chunks and a torn eighth from an interrupted transfer
+    (tmp_path / "in" / f"secret.bin.{fid[:12]}.part").write_bytes(data[:7 * 1024 + 300])
+    pair = Pair(tmp_path / "in")
+    try:
+        assert pair.send(secret)
+    finally:
+        pair.close()
+    assert (tmp_path / "in" / "secret.bin").read_bytes() == data
+    assert pair.sent == list(range(7, 21))
+
+
+def test_refused_and_oversized_offers(tmp_path, secret):
+    pair = Pair(tmp_path / "in")
+    try:
+        assert not pair.send(secret, answer="/reject")
+        pair.receiver.max_size = 1000
+        pair.offered.clear()
+        assert not pair.send(secret)
+    finally:
+        pair.close()
+    assert pair.sent == []
+    assert not (tmp_path / "in").exists() or not os.listdir(tmp_path / "in")
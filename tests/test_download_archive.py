@@ -0,0 +1,80 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import kami_max_toolkit as kmt
+
+URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+@pytest.fixture
+def archive(tmp_path):
+    a = kmt.DownloadArchive(tmp_path / "archive.sqlite")
+    yield a
+    a.close()
+
+
+def fake_attempts(monkeypatch, tmp_path, fail_first=()):
+    """Download attempts that write a file per URL; URLs in `fail_first` raise once."""
+    failed = set()
+    def attempt(url, meter):
+        if url in fail_first and url not in failed:
+            failed.add(url)
+            raise OSError("yt-dlp went away")
+        path = tmp_path / (url.rsplit("/", 1)[-1] + ".mp4")
+        path.write_bytes(url.encode())
+        return 0, [("Fake", url.rsplit("/", 1)[-1], "best", str(path))]
+    monkeypatch.setattr(kmt, "run_download_attempt_api",
+                        lambda local, engines, url, log, meter, *a: attempt(url, meter))
+    monkeypatch.setattr(kmt, "run_download_attempt", lambda cmd, log, meter: attempt(cmd[-1], meter))
+
+
+def test_archive_roundtrip_and_reopen(tmp_path, archive):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"x" * 100)
+    archive.add("https://example.com/v/1", [("Fake", "1", "best", str(path))])
+    archive.close()
+    reopened = kmt.DownloadArchive(tmp_path / "archive.sqlite")
+    try:
+        assert reopened.lookup("https://example.com/v/1") == [str(path)]
+        assert reopened.lookup("https://example.com/v/2") == []
+        path.unlink()
+        assert reopened.lookup("https://example.com/v/1") == []
+    finally:
+        reopened.close()
+
+
+@pytest.mark.skipif(not kmt.YTDLP_API_OK, reason="needs yt_dlp to match URLs to video ids")
+def test_archive_matches_other_urls_of_the_same_video(tmp_path, archive):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"x")
+    extractor, vid = archive.key_for(URL)
+    archive.add(URL, [(extractor, vid, "best", str(path))])
+    assert archive.lookup("https://youtu.be/dQw4w9WgXcQ") == [str(path)]
+
+
+def test_verify_drops_changed_and_missing_files(tmp_path, archive, capsys):
+    files = []
+    for i in range(3):
+        files.append(tmp_path / f"{i}.mp4")
+        files[-1].write_bytes(bytes([i]) * 10)
+        archive.add(f"https://example.com/v/{i}", [("Fake", str(i), "best", str(files[-1]))])
+    files[1].write_bytes(b"y" * 10)
+    files[2].unlink()
+    assert archive.verify() == (1, 2)
+    assert archive.lookup("https://example.com/v/1") == []
+
+
+def test_concurrent_download_records_and_retries(tmp_path, archive, monkeypatch):
+    urls = [f"https://example.com/v/{i}" for i in range(4)]
+    fake_attempts(monkeypatch, tmp_path, fail_first={urls[2]})
+    results = kmt.download_concurrent(urls, str(tmp_path), "%(title)s.%(ext)s", "best", jobs=2,
+                                      backoff=0.01, archive=archive)
+    assert [r["status"] for r in results] == ["ok"] * 4
+    assert [r["attempts"] for r in results] == [1, 1, 2, 1]
+    with open(results[2]["log"], encoding="utf-8") as f:
+        assert "OSError: yt-dlp went away" in f.read()
+    # a second run of the batch skips everything the archive has
+    assert [url for url in urls if not archive.lookup(url)] == []
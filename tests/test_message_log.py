@@ -0,0 +1,96 @@
+import os
+import stat
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pytest.importorskip("cryptography")
+import kami_max_toolkit as kmt
+
+NAMES = ["alice", "bob", "carol"]
+
+
+@pytest.fixture
+def log(tmp_path):
+    path = str(tmp_path / "hist" / "group.log")
+    h = kmt.MessageLog(path, "1234")
+    for i in range(30):
+        h.append(NAMES[i % 3], f"message {i}", ts=1000.0 + i)
+    yield h, path
+    if not h.data.closed:
+        h.close()
+
+
+def texts(result):
+    return [m["text"] for m in result[0]]
+
+
+def test_queries(log):
+    h, _ = log
+    assert len(h) == 30
+    assert texts(h.query(last=3)) == ["message 27", "message 28", "message 29"]
+    assert h.query(last=3)[1]
+    assert texts(h.query(since=1010, until=1012)) == ["message 10", "message 11", "message 12"]
+    assert texts(h.query(since=1025, limit=2)) == ["message 25", "message 26"]
+    assert texts(h.query(last=2, sender="bob")) == ["message 25", "message 28"]
+    assert texts(h.query(since=1003, until=1010, sender="alice")) == ["message 3", "message 6", "message 9"]
+    assert h.query(sender="dave") == ([], False)
+    assert h.query(last=100)[0][0] == {"ts": 1000.0, "name": "alice", "text": "message 0"}
+
+
+def test_reopen_keeps_history_and_checks_pin(log):
+    h, path = log
+    h.close()
+    with pytest.raises(ValueError):
+        kmt.MessageLog(path, "4321")
+    h = kmt.MessageLog(path, "1234")
+    h.append("bob", "after reopen", ts=1.0)  # clamped so the index stays sorted
+    assert len(h) == 31
+    assert texts(h.query(last=2, sender="bob")) == ["message 28", "after reopen"]
+    assert h.query(last=1)[0][0]["ts"] == 1029.0
+    h.close()
+
+
+def test_torn_tail_is_cut_off(log):
+    h, path = log
+    h.close()
+    # a crash after the record but before its index entry, then one mid-record
+    size = os.path.getsize(path)
+    with open(path + ".idx", "r+b") as f:
+        f.truncate(29 * kmt.HISTORY_INDEX.size + 5)
+    with open(path, "r+b") as f:
+        f.truncate(size - 3)
+    os.remove(path + ".sidx")
+    h = kmt.MessageLog(path, "1234")
+    assert len(h) == 29
+    assert os.path.getsize(path + ".idx") == 29 * kmt.HISTORY_INDEX.size
+    h.append("carol", "recovered")
+    assert texts(h.query(last=3)) == ["message 27", "message 28", "recovered"]
+    assert texts(h.query(last=2, sender="carol")) == ["message 26", "recovered"]
+    h.close()
+
+
+def test_stale_sender_index_is_brought_up_to_date(log):
+    h, path = log
+    h.close()
+    with open(path + ".sidx", "rb") as f:
+        stale = f.read()
+    h = kmt.MessageLog(path, "1234")
+    h.append("dave", "new sender")
+    h.close()
+    with open(path + ".sidx", "wb") as f:
+        f.write(stale)
+    h = kmt.MessageLog(path, "1234")
+    assert texts(h.query(sender="dave")) == ["new sender"]
+    h.close()
+
+
+def test_files_are_private_and_encrypted(log):
+    h, path = log
+    h.close()
+    for suffix in ("", ".idx", ".sidx"):
+        assert stat.S_IMODE(os.stat(path + suffix).st_mode) == 0o600
+    with open(path, "rb") as f:
+        data = f.read()
+    assert b"message" not in data and b"alice" not in data
@@ -0,0 +1,109 @@
+import os
+import struct
+import sys
+import zlib
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+Image = pytest.importorskip("PIL.Image")
+import kami_max_toolkit as kmt
+
+W, H, BAND = 37, 150, 64  # bands of 64 rows, the last one short
+
+
+def noise(mode, w=W, h=H):
+    return Image.frombytes(mode, (w, h), os.urandom(w * h * len(mode)))
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA"])
+def test_iter_image_bands_matches_pillow(tmp_path, mode):
+    path = str(tmp_path / "cover.png")
+    noise(mode).save(path, "PNG")  # Pillow picks adaptive row filters
+    bands = list(kmt.iter_image_bands(path, BAND))
+    assert [b.size for b in bands] == [(W, 64), (W, 64), (W, 22)]
+    assert b"".join(b.tobytes() for b in bands) == Image.open(path).convert("RGBA").tobytes()
+
+
+def test_iter_image_bands_falls_back_to_pillow(tmp_path):
+    path = str(tmp_path / "cover.png")
+    noise("L").save(path, "PNG")
+    assert b"".join(b.tobytes() for b in kmt.iter_image_bands(path, BAND)) == \
+        Image.open(path).convert("RGBA").tobytes()
+
+
+def test_png_stream_writer_matches_pillow(tmp_path):
+    img = noise("RGBA")
+    raw = img.tobytes()
+    path = str(tmp_path / "out.png")
+    writer = kmt.PNGStreamWriter(path, W, H)
+    for y in range(0, H, BAND):
+        writer.write_rows(raw[y * W * 4:min(H, y + BAND) * W * 4])
+    writer.close()
+    assert Image.open(path).convert("RGBA").tobytes() == raw
+
+
+@pytest.fixture
+def cover_and_secret(tmp_path):
+    cover = str(tmp_path / "cover.png")
+    noise("RGB", 64, 300).save(cover, "PNG")
+    secret = tmp_path / "secret.bin"
+    secret.write_bytes(os.urandom(5000))  # spans the first two bands
+    return cover, str(secret)
+
+
+def test_tiled_embed_plain_extract(tmp_path, cover_and_secret):
+    cover, secret = cover_and_secret
+    stego = str(tmp_path / "stego.png")
+    assert kmt.hide_file_in_image_tiled(cover, secret, stego, BAND)
+    assert not os.path.exists(stego + ".part")
+    # the pixels outside the LSBs are untouched
+    mask = bytes(0xFE if i % 4 < 3 else 0xFF for i in range(64 * 300 * 4))
+    strip = lambda path: bytes(a & m for a, m in zip(Image.open(path).convert("RGBA").tobytes(), mask))
+    assert strip(stego) == strip(cover)
+    for extract in (kmt.extract_file_from_image, kmt.extract_file_from_image_tiled):
+        out = str(tmp_path / f"{extract.__name__}.bin")
+        assert extract(stego, out) == out
+        with open(out, "rb") as got, open(secret, "rb") as want:
+            assert got.read() == want.read()
+
+
+def test_tiled_embed_leaves_nothing_on_truncated_cover(tmp_path, cover_and_secret):
+    cover, secret = cover_and_secret
+    with open(cover, "rb") as f:
+        data = f.read()
+    with open(cover, "wb") as f:
+        f.write(data[:len(data) // 2])
+    stego = str(tmp_path / "stego.png")
+    assert kmt.hide_file_in_image_tiled(cover, secret, stego, BAND) is None
+    assert not os.path.exists(stego) and not os.path.exists(stego + ".part")
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("legacy", [False, True])
+def test_plain_embed_extract(tmp_path, cover_and_secret, workers, legacy):
+    cover, secret = cover_and_secret
+    if legacy:  # the terminator format can't carry runs of 15 one bits, so no random bytes
+        with open(secret, "wb") as f:
+            f.write(os.urandom(2500).hex().encode())
+    stego, out = str(tmp_path / "stego.png"), str(tmp_path / "out.bin")
+    assert kmt.hide_file_in_image(cover, secret, stego, legacy=legacy)
+    assert kmt.extract_file_from_image(stego, out, workers=workers) == out
+    with open(out, "rb") as got, open(secret, "rb") as want:
+        assert got.read() == want.read()
+
+
+def test_parallel_embed_matches_serial(tmp_path, cover_and_secret):
+    cover, secret = cover_and_secret
+    serial, parallel = str(tmp_path / "serial.png"), str(tmp_path / "parallel.png")
+    assert kmt.hide_file_in_image_tiled(cover, secret, serial, BAND)
+    assert kmt.hide_file_in_image_tiled(cover, secret, parallel, BAND, workers=2)
+    assert Image.open(parallel).convert("RGBA").tobytes() == Image.open(serial).convert("RGBA").tobytes()
+    # the pieces deflated by the workers form one valid zlib stream, checksum included
+    with open(parallel, "rb") as f:
+        data, pos, idat = f.read(), 8, b""
+    while pos < len(data):
+        length, tag = struct.unpack(">I4s", data[pos:pos + 8])
+        idat += data[pos + 8:pos + 8 + length] if tag == b"IDAT" else b""
+        pos += 12 + length
+    assert len(zlib.decompress(idat)) == 300 * (64 * 4 + 1)
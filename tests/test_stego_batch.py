@@ -0,0 +1,80 @@
+import json
+import os
+import sys
+import wave
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import kami_max_toolkit as kmt
+
+
+def read_results(path):
+    """The records, less the torn line a crash leaves (as run_stego_batch reads them)."""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if not line.startswith('{"torn')]
+
+
+@pytest.fixture
+def batch(tmp_path):
+    cover = tmp_path / "cover.wav"
+    with wave.open(str(cover), "wb") as w:
+        w.setnchannels(2); w.setsampwidth(2); w.setframerate(8000)
+        w.writeframes(os.urandom(40000 * 4))
+    secret = tmp_path / "secret.bin"
+    secret.write_bytes(os.urandom(3000))
+    manifest = tmp_path / "jobs.csv"
+    # a blank lsbs cell means the default of 1
+    manifest.write_text("mode,cover,secret,output,lsbs\n"
+                        f"audio-embed,{cover},{secret},{tmp_path / 'stego.wav'},\n"
+                        f"audio-embed,{cover},{secret},{tmp_path / 'stego2.wav'},2\n", encoding="utf-8")
+    return tmp_path, str(manifest)
+
+
+def test_batch_embeds_and_extracts(batch):
+    tmp_path, manifest = batch
+    kmt.run_stego_batch(manifest, workers=1)
+    assert [r["status"] for r in read_results(manifest + ".results.jsonl")] == ["ok", "ok"]
+    out = kmt.extract_audio(str(tmp_path / "stego2.wav"), str(tmp_path / "out"))
+    assert out.read_bytes() == (tmp_path / "secret.bin").read_bytes()
+
+
+def test_batch_resumes_only_jobs_that_need_it(batch, capsys):
+    tmp_path, manifest = batch
+    results = manifest + ".results.jsonl"
+    kmt.run_stego_batch(manifest, workers=1)
+    kmt.run_stego_batch(manifest, workers=1)
+    assert "2 up to date, running 0" in capsys.readouterr().out
+    assert len(read_results(results)) == 2
+    # a changed input reruns every job that reads it
+    secret = tmp_path / "secret.bin"
+    os.utime(secret, ns=(0, os.stat(secret).st_mtime_ns + 10**9))
+    kmt.run_stego_batch(manifest, workers=1)
+    assert len(read_results(results)) == 4
+
+
+def test_batch_reruns_output_left_by_a_crash(batch):
+    tmp_path, manifest = batch
+    results = manifest + ".results.jsonl"
+    kmt.run_stego_batch(manifest, workers=1)
+    # the first job failed last time and left a plausible-looking file behind
+    recs = read_results(results)
+    recs[0]["status"] = "failed"
+    with open(results, "w", encoding="utf-8") as f:
+        f.write("".join(json.dumps(r) + "\n" for r in recs) + '{"torn')
+    (tmp_path / "stego.wav").write_bytes(b"garbage")
+    kmt.run_stego_batch(manifest, workers=1)
+    assert [r["status"] for r in read_results(results)[2:]] == ["ok"]
+    with wave.open(str(tmp_path / "stego.wav")) as w:
+        assert w.getnframes() == 40000
+
+
+def test_manifest_skips_lines_that_are_not_objects(tmp_path, capsys):
+    manifest = tmp_path / "jobs.jsonl"
+    manifest.write_text('{"mode": "image-extract", "cover": "a.png", "output": " "}\n'
+                        '# comment\n[1, 2]\n{broken\n"text"\n{"mode": "image-extract", "cover": "b.png"}\n',
+                        encoding="utf-8")
+    assert kmt.load_manifest(str(manifest)) == [{"mode": "image-extract", "cover": "a.png"},
+                                                {"mode": "image-extract", "cover": "b.png"}]
+    out = capsys.readouterr().out
+    assert ":3:" in out and ":4:" in out and ":5:" in out